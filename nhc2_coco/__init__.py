@@ -5,11 +5,28 @@ from .coco_switch import CoCoSwitch
 from .coco_fan import CoCoFan
 from .coco_climate import CoCoThermostat
 from .coco_device_class import CoCoDeviceClass
+from .coco_buffer_policy import CoCoBufferPolicy
+from .coco_callback_executor import CoCoCallbackExecutor
 
 __all__ = ["CoCo",
+           "AsyncCoCo",
+           "CoCoPool",
            "CoCoEntity",
            "CoCoLight",
            "CoCoSwitch",
            "CoCoFan",
            "CoCoThermostat",
-           "CoCoDeviceClass"]
+           "CoCoDeviceClass",
+           "CoCoBufferPolicy",
+           "CoCoCallbackExecutor"]
+
+
+def __getattr__(name):
+    # AsyncCoCo pulls in asyncio, only import it for those who use it
+    if name == 'AsyncCoCo':
+        from .coco_async import AsyncCoCo
+        return AsyncCoCo
+    if name == 'CoCoPool':
+        from .coco_pool import CoCoPool
+        return CoCoPool
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -1,13 +1,21 @@
-import json
 import logging
 import os
 import threading
-from time import sleep
+from itertools import count
+from time import monotonic, perf_counter
 from typing import Callable
 
 import paho.mqtt.client as mqtt
 
+from . import codec
+from .coco_backoff import CoCoBackoff
+from .coco_buffer_policy import CoCoBufferPolicy
+from .coco_cache import CoCoCache
+from .coco_callback_executor import CoCoCallbackExecutor
 from .coco_device_class import CoCoDeviceClass
+from .coco_device_control_buffer import CoCoDeviceControlBuffer
+from .coco_device_registry import CoCoDeviceRegistry
+from .coco_entity import CoCoEntity
 from .coco_fan import CoCoFan
 from .coco_light import CoCoLight
 from .coco_shutter import CoCoShutter
@@ -15,12 +23,15 @@ from .coco_switch import CoCoSwitch
 from .coco_switched_fan import CoCoSwitchedFan
 from .coco_climate import CoCoThermostat
 from .coco_generic import CoCoGeneric
+from .coco_latency_stats import CoCoLatencyStats
+from .coco_metrics import COUNTER
+from .coco_trace_stage import CoCoTraceStage
+from .coco_tracer import trace_start, trace_end
 
 from .const import *
 from .helpers import *
 
 _LOGGER = logging.getLogger(__name__)
-sem = threading.Semaphore()
 DEVICE_SETS = {
     CoCoDeviceClass.SWITCHED_FANS: {INTERNAL_KEY_CLASS: CoCoSwitchedFan, INTERNAL_KEY_MODELS: LIST_VALID_SWITCHED_FANS},
     CoCoDeviceClass.FANS: {INTERNAL_KEY_CLASS: CoCoFan, INTERNAL_KEY_MODELS: LIST_VALID_FANS},
@@ -33,24 +44,35 @@ DEVICE_SETS = {
 
 
 class CoCo:
-    def __init__(self, address, username, password, port=8883, ca_path=None, switches_as_lights=False):
+    def __init__(self, address, username, password, port=8883, ca_path=None, switches_as_lights=False,
+                 device_control_quiet_time=DEVICE_CONTROL_QUIET_TIME,
+                 device_control_buffer_policy=CoCoBufferPolicy.BLOCK, device_control_buffer_timeout=None,
+                 callback_executor=None, cache_path=None, device_control_rate_limit=None):
 
+        # Every instance gets its own device sets, so switches_as_lights doesn't leak into other instances
+        self._device_sets = dict(DEVICE_SETS)
         if switches_as_lights:
-            DEVICE_SETS[CoCoDeviceClass.LIGHTS] = {INTERNAL_KEY_CLASS: CoCoLight,
-                                                   INTERNAL_KEY_MODELS: LIST_VALID_LIGHTS + LIST_VALID_SWITCHES}
-            DEVICE_SETS[CoCoDeviceClass.SWITCHES] = {INTERNAL_KEY_CLASS: CoCoSwitch, INTERNAL_KEY_MODELS: []}
+            self._device_sets[CoCoDeviceClass.LIGHTS] = {INTERNAL_KEY_CLASS: CoCoLight,
+                                                         INTERNAL_KEY_MODELS: LIST_VALID_LIGHTS + LIST_VALID_SWITCHES}
+            self._device_sets[CoCoDeviceClass.SWITCHES] = {INTERNAL_KEY_CLASS: CoCoSwitch, INTERNAL_KEY_MODELS: []}
+        self._device_classes_by_model = {model: device_class
+                                         for device_class, device_set in self._device_sets.items()
+                                         for model in device_set[INTERNAL_KEY_MODELS]}
         # The device control buffer fields
         self._keep_thread_running = True
-        self._device_control_buffer = {}
-        self._device_control_buffer_size = DEVICE_CONTROL_BUFFER_SIZE
-        self._device_control_buffer_command_size = DEVICE_CONTROL_BUFFER_COMMAND_SIZE
-        self._device_control_buffer_command_count = 0
-        self._device_control_buffer_thread = threading.Thread(target=self._publish_device_control_commands)
-        self._device_control_buffer_thread.start()
+        # Taking commands from the buffer and publishing them is done under this lock, so they go out in order
+        self._device_control_publish_lock = threading.Lock()
+        self._device_control_buffer = CoCoDeviceControlBuffer(policy=device_control_buffer_policy,
+                                                              timeout=device_control_buffer_timeout,
+                                                              rate_limit=device_control_rate_limit)
+        self._device_control_quiet_time = device_control_quiet_time
+        self._device_control_latency = CoCoLatencyStats()
+        self._batch_publish_latency = CoCoLatencyStats()
+        self._start_device_control_dispatcher()
 
         if ca_path is None:
             ca_path = os.path.dirname(os.path.realpath(__file__)) + MQTT_CERT_FILE
-        client = mqtt.Client(protocol=MQTT_PROTOCOL, transport=MQTT_TRANSPORT)
+        client = self._create_client()
         client.username_pw_set(username, password)
         client.tls_set(ca_path)
         client.tls_insecure_set(True)
@@ -60,81 +82,407 @@ class CoCo:
         self._profile_creation_id = username
         self._all_devices = None
         self._device_callbacks = {}
-        self._devices = {}
+        self._devices = CoCoDeviceRegistry()
+        self._devices_listed = False
+        self._device_snapshots = {}
         self._devices_callback = {}
+        # Shut down on disconnect when it's our own, a passed executor can be shared
+        self._owns_callback_executor = callback_executor is None
+        self._callback_executor = callback_executor if callback_executor is not None else CoCoCallbackExecutor()
+        self._on_devices_added = lambda x: None
+        self._on_devices_removed = lambda x: None
+        self._on_entities_changed = None
+        # uuid -> the fields last reported to on_entities_changed, kept while it's set
+        self._reported_fields = {}
         self._system_info = None
         self._system_info_callback = lambda x: None
+        self._cache = CoCoCache(cache_path, address, username) if cache_path else None
+        self._recorder = None
+        self._metrics = None
+        self._tracers = []
+        self._trace_ids = count(1)
+        # The correlation id of the message being handled, while tracing
+        self._trace_correlation_id = None
+        self._connect_count = 0
+        self._available = False
+        self._on_availability_changed = lambda x: None
+        # Shared by all entities, their online is False while the connection is lost
+        self._is_available = lambda: self._available
+        self._reconnect_backoff = CoCoBackoff()
+        # Topics are built once, they're used on every message
+        self._topic_cmd = self._profile_creation_id + MQTT_TOPIC_SUFFIX_CMD
+        self._topic_rsp = self._profile_creation_id + MQTT_TOPIC_SUFFIX_RSP
+        self._topic_sys_cmd = self._profile_creation_id + MQTT_TOPIC_PUBLIC_CMD
+        # topic -> method -> handlers
+        self._message_handlers = {}
+        self.add_message_handler(MQTT_TOPIC_PUBLIC_RSP, MQTT_METHOD_SYSINFO_PUBLISH, self._process_system_info)
+        self.add_message_handler(MQTT_TOPIC_SUFFIX_RSP, MQTT_METHOD_DEVICES_LIST, self._process_devices_list_response)
+        self.add_message_handler(MQTT_TOPIC_SUFFIX_SYS_EVT, MQTT_METHOD_SYSINFO_PUBLISHED,
+                                 self._process_system_info_published)
+        self.add_message_handler(MQTT_TOPIC_SUFFIX_EVT, MQTT_METHOD_DEVICES_STATUS, self._process_devices_event)
+        self.add_message_handler(MQTT_TOPIC_SUFFIX_EVT, MQTT_METHOD_DEVICES_CHANGED, self._process_devices_event)
+
+    @property
+    def devices(self):
+        """The CoCoDeviceRegistry with all known entities."""
+        return self._devices
+
+    @property
+    def on_devices_added(self):
+        """Called with the list of entities that appeared in a devices.list after the first one."""
+        return self._on_devices_added
+
+    @on_devices_added.setter
+    def on_devices_added(self, func):
+        self._on_devices_added = func
+
+    @property
+    def on_devices_removed(self):
+        """Called with the list of entities that are no longer in devices.list."""
+        return self._on_devices_removed
+
+    @on_devices_removed.setter
+    def on_devices_removed(self, func):
+        self._on_devices_removed = func
+
+    @property
+    def on_entities_changed(self):
+        """Called once per message with what it changed: a list of (entity, {field: value}), None by default.
+
+        The fields are the ones whose value differs from what was known, eg. {'Brightness': '40'}, all
+        of them when nothing was known yet. It runs through the callback executor, in the order of the
+        messages, and the on_change of every entity still runs too.
+        """
+        return self._on_entities_changed
+
+    @on_entities_changed.setter
+    def on_entities_changed(self, func):
+        self._on_entities_changed = func
+        self._reported_fields = {}
+
+    @property
+    def available(self):
+        """True while connected to the controller. In between, every entity's online is False."""
+        return self._available
+
+    @property
+    def on_availability_changed(self):
+        """Called once with True or False when the connection to the controller is made or lost."""
+        return self._on_availability_changed
+
+    @on_availability_changed.setter
+    def on_availability_changed(self, func):
+        self._on_availability_changed = func
+
+    @property
+    def callback_executor(self):
+        """The CoCoCallbackExecutor running the on_change callbacks, holds their timings and error count."""
+        return self._callback_executor
+
+    @property
+    def recorder(self):
+        """A CoCoRecorder that gets every received message, None by default."""
+        return self._recorder
+
+    @recorder.setter
+    def recorder(self, recorder):
+        self._recorder = recorder
+
+    @property
+    def metrics(self):
+        """A CoCoMetrics that counts and times messages, updates and commands, None by default."""
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        if metrics is not None:
+            buffer = self._device_control_buffer
+            metrics.add_callback('nhc2_device_control_buffer_depth', 'Commands waiting in the device control buffer',
+                                 lambda: len(buffer))
+            metrics.add_callback('nhc2_device_control_coalesced_total',
+                                 'Commands that replaced a waiting one for the same property',
+                                 lambda: buffer.coalesced_count, COUNTER)
+            metrics.add_callback('nhc2_reconnects_total', 'Connections made after the first one',
+                                 lambda: self.reconnect_count, COUNTER)
+        self._metrics = metrics
+
+    @property
+    def reconnect_count(self):
+        return max(0, self._connect_count - 1)
+
+    @property
+    def device_control_latency(self):
+        """Enqueue-to-publish latency of device control commands, see CoCoLatencyStats."""
+        return self._device_control_latency
+
+    @property
+    def batch_publish_latency(self):
+        """Latency from control_many to the publish of each of its messages, see CoCoLatencyStats."""
+        return self._batch_publish_latency
+
+    @property
+    def device_control_buffer(self):
+        """The buffer of pending device control commands, holds the throttle counters."""
+        return self._device_control_buffer
+
+    def _create_client(self):
+        return mqtt.Client(protocol=MQTT_PROTOCOL, transport=MQTT_TRANSPORT)
 
     def __del__(self):
         self._keep_thread_running = False
+        self._device_control_buffer.close()
         self._client.disconnect()
 
     def connect(self):
+        self._load_cache()
+        self._attach_client_callbacks()
+        self._client.connect_async(self._address, self._port)
+        self._client.loop_start()
 
-        def _on_message(client, userdata, message):
-            topic = message.topic
-            response = json.loads(message.payload)
-
-            if topic == self._profile_creation_id + MQTT_TOPIC_PUBLIC_RSP and \
-                    response[KEY_METHOD] == MQTT_METHOD_SYSINFO_PUBLISH:
-                self._system_info = response
-                self._system_info_callback(self._system_info)
-
-            elif topic == (self._profile_creation_id + MQTT_TOPIC_SUFFIX_RSP) and \
-                    response[KEY_METHOD] == MQTT_METHOD_DEVICES_LIST:
-                self._client.unsubscribe(self._profile_creation_id + MQTT_TOPIC_SUFFIX_RSP)
-                self._process_devices_list(response)
-
-            elif topic == (self._profile_creation_id + MQTT_TOPIC_SUFFIX_SYS_EVT) and \
-                    response[KEY_METHOD] == MQTT_METHOD_SYSINFO_PUBLISHED:
-                # If the connected controller publishes sysinfo... we expect something to have changed.
-                client.subscribe(self._profile_creation_id + MQTT_TOPIC_SUFFIX_RSP, qos=1)
-                client.publish(self._profile_creation_id + MQTT_TOPIC_SUFFIX_CMD,
-                               json.dumps({KEY_METHOD: MQTT_METHOD_DEVICES_LIST}), 1)
-
-            elif topic == (self._profile_creation_id + MQTT_TOPIC_SUFFIX_EVT) \
-                    and (response[KEY_METHOD] == MQTT_METHOD_DEVICES_STATUS or response[
-                KEY_METHOD] == MQTT_METHOD_DEVICES_CHANGED):
-                devices = extract_devices(response)
-                for device in devices:
-                    try:
-                        if KEY_UUID in device:
-                            self._device_callbacks[device[KEY_UUID]][INTERNAL_KEY_CALLBACK](device)
-                    except:
-                        pass
-
-        def _on_connect(client, userdata, flags, rc):
-            if rc == 0:
-                _LOGGER.info('Connected!')
-                client.subscribe(self._profile_creation_id + MQTT_TOPIC_SUFFIX_RSP, qos=1)
-                client.subscribe(self._profile_creation_id + MQTT_TOPIC_PUBLIC_RSP, qos=1)
-                client.subscribe(self._profile_creation_id + MQTT_TOPIC_SUFFIX_EVT, qos=1)
-                client.subscribe(self._profile_creation_id + MQTT_TOPIC_SUFFIX_SYS_EVT, qos=1)
-                client.publish(self._profile_creation_id + MQTT_TOPIC_PUBLIC_CMD,
-                               json.dumps({KEY_METHOD: MQTT_METHOD_SYSINFO_PUBLISH}), 1)
-                client.publish(self._profile_creation_id + MQTT_TOPIC_SUFFIX_CMD,
-                               json.dumps({KEY_METHOD: MQTT_METHOD_DEVICES_LIST}), 1)
-            elif MQTT_RC_CODES[rc]:
-                raise Exception(MQTT_RC_CODES[rc])
-            else:
-                raise Exception('Unknown error')
+    def add_message_handler(self, topic_suffix, method, handler: Callable):
+        """Call handler with every decoded message with the given Method on profile + topic_suffix.
 
-        def _on_disconnect(client, userdata, rc):
-            _LOGGER.warning('Disconnected')
-            for uuid, device_callback in self._device_callbacks.items():
-                offline = {'Online': 'False', KEY_UUID: uuid}
-                device_callback[INTERNAL_KEY_CALLBACK](offline)
+        eg. coco.add_message_handler('/notification/evt', 'notifications.raised', handler)
+        The topic is subscribed to when connecting, or right away when already connected.
+        """
+        topic = self._profile_creation_id + topic_suffix
+        topic_handlers = self._message_handlers.setdefault(topic, {})
+        if not topic_handlers:
+            self._client.subscribe(topic, qos=1)
+        topic_handlers.setdefault(method, []).append(handler)
 
-        self._client.on_message = _on_message
-        self._client.on_connect = _on_connect
-        self._client.on_disconnect = _on_disconnect
+    def remove_message_handler(self, topic_suffix, method, handler: Callable):
+        topic = self._profile_creation_id + topic_suffix
+        handlers = self._message_handlers.get(topic, {}).get(method, [])
+        if handler in handlers:
+            handlers.remove(handler)
 
-        self._client.connect_async(self._address, self._port)
-        self._client.loop_start()
+    def add_tracer(self, tracer):
+        """Tell tracer (a CoCoTracer) about the start and end of every CoCoTraceStage.
+
+        eg. to profile or add spans for message handling and command publishing.
+        """
+        # The list is replaced instead of changed, so a message sees the same tracers start and end
+        if tracer not in self._tracers:
+            self._tracers = self._tracers + [tracer]
+        self._callback_executor.add_tracer(tracer)
+
+    def remove_tracer(self, tracer):
+        self._tracers = [other for other in self._tracers if other is not tracer]
+        self._callback_executor.remove_tracer(tracer)
+
+    def publish(self, topic_suffix, message):
+        """Publish message (a dict, eg. {'Method': 'locations.list'}) on profile + topic_suffix."""
+        self._client.publish(self._profile_creation_id + topic_suffix, codec.dumps(message), 1)
+
+    def _attach_client_callbacks(self):
+        self._client.on_message = self._on_message
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+
+    def _on_message(self, client, userdata, message):
+        tracers = self._tracers
+        if tracers:
+            self._on_traced_message(message, tracers)
+            return
+        if self._recorder is not None:
+            self._recorder.record(message.topic, message.payload)
+        topic_handlers = self._message_handlers.get(message.topic)
+        metrics = self._metrics
+        if not topic_handlers:
+            if metrics is not None:
+                metrics.message_received(self._topic_suffix(message.topic), None, 0.0)
+            return
+        if metrics is None:
+            response = codec.loads(message.payload)
+        else:
+            started = perf_counter()
+            response = codec.loads(message.payload)
+            metrics.message_received(self._topic_suffix(message.topic), response.get(KEY_METHOD),
+                                     perf_counter() - started)
+        for handler in topic_handlers.get(response.get(KEY_METHOD), ()):
+            handler(response)
+
+    def _on_traced_message(self, message, tracers):
+        """_on_message, telling tracers about every stage."""
+        correlation_id = next(self._trace_ids)
+        self._trace_correlation_id = correlation_id
+        self._callback_executor.set_correlation_id(correlation_id)
+        arrived_at = trace_start(tracers, CoCoTraceStage.ARRIVAL, correlation_id,
+                                 {'topic': message.topic, 'size': len(message.payload)})
+        try:
+            if self._recorder is not None:
+                self._recorder.record(message.topic, message.payload)
+            topic_handlers = self._message_handlers.get(message.topic)
+            metrics = self._metrics
+            if not topic_handlers:
+                if metrics is not None:
+                    metrics.message_received(self._topic_suffix(message.topic), None, 0.0)
+                return
+            started = trace_start(tracers, CoCoTraceStage.DECODE, correlation_id, {})
+            response = codec.loads(message.payload)
+            decode_time = perf_counter() - started
+            trace_end(tracers, CoCoTraceStage.DECODE, correlation_id, started)
+            method = response.get(KEY_METHOD)
+            if metrics is not None:
+                metrics.message_received(self._topic_suffix(message.topic), method, decode_time)
+            started = trace_start(tracers, CoCoTraceStage.ROUTING, correlation_id, {'method': method})
+            try:
+                for handler in topic_handlers.get(method, ()):
+                    handler(response)
+            finally:
+                trace_end(tracers, CoCoTraceStage.ROUTING, correlation_id, started)
+        finally:
+            self._trace_correlation_id = None
+            self._callback_executor.set_correlation_id(None)
+            trace_end(tracers, CoCoTraceStage.ARRIVAL, correlation_id, arrived_at)
+
+    def _topic_suffix(self, topic):
+        return topic[len(self._profile_creation_id):] if topic.startswith(self._profile_creation_id) else topic
+
+    def _process_system_info(self, response):
+        if self._cache:
+            if self._cache.system_info is not None and not self._cache.is_valid_for(response):
+                _LOGGER.info('The controller was updated or reconfigured, dropping the device cache')
+                self._cache.invalidate()
+            self._cache.save_system_info(response)
+        self._system_info = response
+        self._system_info_callback(self._system_info)
+
+    def _process_devices_list_response(self, response):
+        self._client.unsubscribe(self._topic_rsp)
+        self._process_devices_list(response)
+        if self._cache:
+            self._cache.save_devices_list(response)
+
+    def _load_cache(self):
+        """Build the entities from the cached devices.list, they're stale until the controller lists them."""
+        if not self._cache or self._devices_listed or not self._cache.load():
+            return
+        _LOGGER.debug('Warm start from %s', self._cache.path)
+        if self._cache.system_info is not None:
+            self._system_info = self._cache.system_info
+        try:
+            self._process_devices_list(self._cache.devices_list, stale=True)
+        except Exception:
+            _LOGGER.exception('Failed to process the device cache %s', self._cache.path)
+            self._cache.invalidate()
+
+    def _process_system_info_published(self, response):
+        # If the connected controller publishes sysinfo... we expect something to have changed.
+        self._client.subscribe(self._topic_rsp, qos=1)
+        self._client.publish(self._topic_cmd, codec.dumps({KEY_METHOD: MQTT_METHOD_DEVICES_LIST}), 1)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            _LOGGER.info('Connected!')
+            self._reconnect_backoff.connected()
+            self._connect_count += 1
+            self._set_available(True)
+            # The devices.list is compared to the last known state, only what differs is updated
+            for topic in self._message_handlers:
+                client.subscribe(topic, qos=1)
+            client.publish(self._topic_sys_cmd, codec.dumps({KEY_METHOD: MQTT_METHOD_SYSINFO_PUBLISH}), 1)
+            client.publish(self._topic_cmd, codec.dumps({KEY_METHOD: MQTT_METHOD_DEVICES_LIST}), 1)
+        elif MQTT_RC_CODES[rc]:
+            raise Exception(MQTT_RC_CODES[rc])
+        else:
+            raise Exception('Unknown error')
+
+    def _on_disconnect(self, client, userdata, rc):
+        _LOGGER.warning('Disconnected')
+        self._schedule_reconnect()
+        self._set_available(False)
+
+    def _schedule_reconnect(self):
+        # paho's network thread reconnects, from a jittered delay that doubles with every failed attempt
+        self._client.reconnect_delay_set(self._reconnect_backoff.next_delay(), MQTT_RECONNECT_MAX_DELAY)
+
+    def _set_available(self, available):
+        if self._available == available:
+            return
+        self._available = available
+        try:
+            self._on_availability_changed(available)
+        except Exception:
+            _LOGGER.exception('on_availability_changed failed')
+
+    # Processes devices.status and devices.changed events
+    def _process_devices_event(self, response):
+        devices = extract_devices(response)
+        metrics = self._metrics
+        correlation_id = self._trace_correlation_id
+        changes = [] if self._on_entities_changed is not None else None
+        if metrics is not None and response.get(KEY_METHOD) == MQTT_METHOD_DEVICES_CHANGED:
+            changed_at = monotonic()
+            for device in devices:
+                metrics.device_changed(device.get(KEY_UUID), changed_at)
+        for device in devices:
+            uuid = device.get(KEY_UUID)
+            device_callback = self._device_callbacks.get(uuid)
+            if device_callback is None:
+                continue
+            try:
+                if metrics is None and correlation_id is None:
+                    has_changed = device_callback[INTERNAL_KEY_CALLBACK](device)
+                else:
+                    has_changed = self._update_device(device_callback, device, metrics, correlation_id)
+                if has_changed:
+                    if changes is not None:
+                        fields = self._changed_fields(uuid, device)
+                        if fields:
+                            changes.append((device_callback[KEY_ENTITY], fields))
+                    # The snapshot is no longer the last known state, the next devices.list must update it
+                    self._device_snapshots[uuid] = None
+                self._device_updated(device_callback[KEY_ENTITY], has_changed)
+            except Exception:
+                _LOGGER.exception('Failed to process the update of device %s', device[KEY_UUID])
+        if changes:
+            self._entities_changed(changes)
+
+    def _entities_changed(self, changes):
+        self._callback_executor.call(self._on_entities_changed, changes)
+
+    def _changed_fields(self, uuid, device):
+        """The fields of device that differ from the ones known for uuid, which are updated."""
+        fields = extract_reported_fields(device)
+        known = self._reported_fields.get(uuid)
+        if known is None:
+            # Until a device event changes it, the snapshot of the last devices.list is what's known
+            snapshot = self._device_snapshots.get(uuid)
+            if snapshot is None:
+                self._reported_fields[uuid] = fields
+                return fields
+            known = self._reported_fields[uuid] = extract_reported_fields(snapshot)
+        changed = {key: value for key, value in fields.items() if known.get(key) != value}
+        known.update(changed)
+        return changed
+
+    def _update_device(self, device_callback, device, metrics, correlation_id):
+        """Update the entity of device_callback with device, timed for metrics and tracers."""
+        entity = device_callback[KEY_ENTITY]
+        tracers = self._tracers
+        if correlation_id is not None:
+            trace_start(tracers, CoCoTraceStage.UPDATE, correlation_id, {'uuid': entity.uuid, 'model': entity.model})
+        started = perf_counter()
+        try:
+            return device_callback[INTERNAL_KEY_CALLBACK](device)
+        finally:
+            if metrics is not None:
+                metrics.device_updated(entity.model, perf_counter() - started)
+            if correlation_id is not None:
+                trace_end(tracers, CoCoTraceStage.UPDATE, correlation_id, started)
+
+    def _device_updated(self, entity, has_changed):
+        """Called after the controller reported a state for entity. Override to react to it."""
+        pass
 
     def disconnect(self):
         self._client.loop_stop()
         self._client.disconnect()
+        if self._owns_callback_executor:
+            # Without waiting, disconnect may be called from a callback
+            self._callback_executor.shutdown(wait=False)
 
     def get_systeminfo(self, callback):
         self._system_info_callback = callback
@@ -143,80 +491,254 @@ class CoCo:
 
     def get_devices(self, device_class: CoCoDeviceClass, callback: Callable):
         self._devices_callback[device_class] = callback
-        if self._devices and device_class in self._devices:
-            self._devices_callback[device_class](self._devices[device_class])
+        if self._devices_listed:
+            self._devices_callback[device_class](self._devices.by_device_class(device_class))
+
+    def get(self, uuid):
+        return self._devices.get(uuid)
+
+    def by_model(self, model):
+        return self._devices.by_model(model)
+
+    def by_device_class(self, device_class: CoCoDeviceClass):
+        return self._devices.by_device_class(device_class)
+
+    def _start_device_control_dispatcher(self):
+        self._device_control_buffer_thread = threading.Thread(target=self._publish_device_control_commands,
+                                                              daemon=True)
+        self._device_control_buffer_thread.start()
 
     def _publish_device_control_commands(self):
         while self._keep_thread_running:
-            device_commands_to_process = None
-            sem.acquire()
-            if len(self._device_control_buffer.keys()) > 0:
-                device_commands_to_process = self._device_control_buffer
-            self._device_control_buffer = {}
-            self._device_control_buffer_command_count = 0
-            sem.release()
-            if device_commands_to_process is not None:
-                command = process_device_commands(device_commands_to_process)
-                self._client.publish(self._profile_creation_id + MQTT_TOPIC_SUFFIX_CMD, json.dumps(command), 1)
-            sleep(0.05)
+            if not self._device_control_buffer.wait(self._device_control_quiet_time):
+                break
+            try:
+                self._flush_device_control_buffer()
+            except Exception:
+                # Only this batch is lost, the thread has to keep flushing or producers block forever
+                _LOGGER.exception('Failed to publish the device control commands for %s', self._address)
+
+    def _publish_device_control_batch(self, batch):
+        device_commands_to_process, enqueue_times = batch
+        tracers = self._tracers
+        if tracers:
+            self._publish_traced_device_control_batch(device_commands_to_process, tracers)
+        else:
+            command = process_device_commands(device_commands_to_process)
+            self._client.publish(self._topic_cmd, codec.dumps(command), 1)
+        published_at = monotonic()
+        for enqueued_at in enqueue_times:
+            self._device_control_latency.add(published_at - enqueued_at)
+        if self._metrics is not None:
+            self._metrics.commands_published(device_commands_to_process, published_at)
+
+    def _publish_traced_device_control_batch(self, device_commands, tracers):
+        correlation_id = next(self._trace_ids)
+        flushed_at = trace_start(tracers, CoCoTraceStage.FLUSH, correlation_id, {'devices': len(device_commands)})
+        try:
+            started = trace_start(tracers, CoCoTraceStage.ENCODE, correlation_id, {})
+            payload = codec.dumps(process_device_commands(device_commands))
+            trace_end(tracers, CoCoTraceStage.ENCODE, correlation_id, started)
+            started = trace_start(tracers, CoCoTraceStage.PUBLISH, correlation_id, {'size': len(payload)})
+            try:
+                self._client.publish(self._topic_cmd, payload, 1)
+            finally:
+                trace_end(tracers, CoCoTraceStage.PUBLISH, correlation_id, started)
+        finally:
+            trace_end(tracers, CoCoTraceStage.FLUSH, correlation_id, flushed_at)
 
     def _add_device_control(self, uuid, property_key, property_value):
-        while len(self._device_control_buffer.keys()) >= self._device_control_buffer_size or \
-                self._device_control_buffer_command_count >= self._device_control_buffer_command_size:
-            pass
-        sem.acquire()
-        self._device_control_buffer_command_count += 1
-        if uuid not in self._device_control_buffer:
-            self._device_control_buffer[uuid] = {}
-        self._device_control_buffer[uuid][property_key] = property_value
-        sem.release()
-
-    # Processes response on devices.list
-    def _process_devices_list(self, response):
-
-        # Only add devices that are actionable
-        actionable_devices = list(
-            filter(lambda d: d[KEY_TYPE] == DEV_TYPE_ACTION, extract_devices(response)))
-        actionable_devices.extend(list(
-            filter(lambda d: d[KEY_TYPE] == "thermostat", extract_devices(response))))
-
-        # Only prepare for devices that don't already exist
-        # TODO - Can't we do this when we need it (in initialize_devices ?)
-        existing_uuids = list(self._device_callbacks.keys())
-        for actionable_device in actionable_devices:
-            if actionable_device[KEY_UUID] not in existing_uuids:
-                self._device_callbacks[actionable_device[KEY_UUID]] = \
-                    {INTERNAL_KEY_CALLBACK: None, KEY_ENTITY: None}
-
-        # Initialize
-        self.initialize_devices(CoCoDeviceClass.SWITCHED_FANS, actionable_devices)
-        self.initialize_devices(CoCoDeviceClass.FANS, actionable_devices)
-        self.initialize_devices(CoCoDeviceClass.SWITCHES, actionable_devices)
-        self.initialize_devices(CoCoDeviceClass.LIGHTS, actionable_devices)
-        self.initialize_devices(CoCoDeviceClass.SHUTTERS, actionable_devices)
-        self.initialize_devices(CoCoDeviceClass.THERMOSTATS, actionable_devices)
-        self.initialize_devices(CoCoDeviceClass.GENERIC, actionable_devices)
+        self._device_control_buffer.add(uuid, property_key, property_value)
+
+    def _add_device_controls(self, commands):
+        self._device_control_buffer.add_commands(commands)
+
+    def _flush_device_control_buffer(self):
+        with self._device_control_publish_lock:
+            batch = self._device_control_buffer.take_nowait()
+            if batch is not None:
+                self._publish_device_control_batch(batch)
+
+    def control(self, commands):
+        """Control several devices at once, eg. for a scene. They are sent in one devices.control message.
+
+        commands maps entities (or their uuid) to the properties to set: {light: {'Status': 'On'}, ...}
+        """
+        return self._add_device_controls(self._device_commands(commands))
+
+    def control_many(self, commands, max_message_size=DEVICE_CONTROL_MAX_MESSAGE_SIZE):
+        """Control a large group of devices, eg. all off. Returns the number of devices.control messages.
+
+        commands is like for control(), or a list of (entity, properties). The commands skip the buffer and
+        are published right away, in as few messages of at most max_message_size bytes as possible.
+        Commands still buffered for these devices go along in the same messages, the ones given here win.
+        The rate limit doesn't hold these back, but the devices count as just controlled for it.
+        """
+        started_at = monotonic()
+        commands = self._device_commands(commands)
+        with self._device_control_publish_lock:
+            # Buffered commands must not be published after these and overwrite them
+            buffered, enqueue_times = self._take_device_commands(commands)
+            commands = self._merge_device_commands(buffered, commands)
+            payloads = self._device_control_payloads(commands, max_message_size)
+            for payload in payloads:
+                self._client.publish(self._topic_cmd, payload, 1)
+                self._batch_publish_latency.add(monotonic() - started_at)
+        published_at = monotonic()
+        for enqueued_at in enqueue_times:
+            self._device_control_latency.add(published_at - enqueued_at)
+        if self._metrics is not None:
+            self._metrics.commands_published(commands, published_at, flush=False)
+        return len(payloads)
+
+    def _take_device_commands(self, uuids):
+        """Take the commands waiting for uuids as (commands, enqueue_times), oldest first."""
+        return self._device_control_buffer.take_devices(uuids)
+
+    @staticmethod
+    def _merge_device_commands(older, newer):
+        """Return older with newer applied on top, a property of newer moves to the end of its device."""
+        merged = {uuid: dict(properties) for uuid, properties in older.items()}
+        for uuid, properties in newer.items():
+            device_commands = merged.setdefault(uuid, {})
+            for property_key, property_value in properties.items():
+                device_commands.pop(property_key, None)
+                device_commands[property_key] = property_value
+        return merged
+
+    @staticmethod
+    def _device_commands(commands):
+        """Return commands as uuid -> {property_key: property_value}."""
+        items = commands.items() if isinstance(commands, dict) else commands
+        device_commands = {}
+        for entity, properties in items:
+            uuid = entity.uuid if isinstance(entity, CoCoEntity) else entity
+            device_commands.setdefault(uuid, {}).update(properties)
+        return device_commands
+
+    @staticmethod
+    def _device_control_payloads(commands, max_message_size):
+        """Encode commands in devices.control payloads of at most max_message_size bytes, when possible."""
+        message = process_device_commands(commands)
+        devices = extract_devices(message)
+        message_size = len(codec.dumps(process_device_commands({})))
+        batches = [[]]
+        size = message_size
+        for device in devices:
+            # One more for the separator
+            device_size = len(codec.dumps(device)) + 1
+            if batches[-1] and size + device_size > max_message_size:
+                batches.append([])
+                size = message_size
+            batches[-1].append(device)
+            size += device_size
+        if len(batches) == 1:
+            return [codec.dumps(message)] if devices else []
+        return [codec.dumps({KEY_METHOD: MQTT_METHOD_DEVICES_CONTROL, KEY_PARAMS: [{KEY_DEVICES: batch}]})
+                for batch in batches]
+
+    # Processes response on devices.list, only what differs from the previous list is processed
+    def _process_devices_list(self, response, stale=False):
+
+        # Only add devices that are actionable, grouped by the class they belong to
+        devices_by_class = {device_class: [] for device_class in self._device_sets}
+        listed_uuids = set()
+        for device in extract_devices(response):
+            if device[KEY_TYPE] == DEV_TYPE_ACTION or device[KEY_TYPE] == DEV_TYPE_THERMOSTAT:
+                device_class = self._device_classes_by_model.get(device[KEY_MODEL])
+                if device_class is not None:
+                    devices_by_class[device_class].append(device)
+                    listed_uuids.add(device[KEY_UUID])
+
+        first_list = not self._devices_listed
+        self._devices_listed = True
+
+        # The live list confirms every cached entity, the classes they're in are reported as changed
+        stale_classes = set()
+        if not stale:
+            for entity in self._devices:
+                if entity.stale:
+                    entity.stale = False
+                    stale_classes.add(self._devices.device_class_of(entity.uuid))
+
+        removed_classes = set()
+        removed = []
+        for uuid in [uuid for uuid in self._device_snapshots if uuid not in listed_uuids]:
+            removed_classes.add(self._devices.device_class_of(uuid))
+            removed.append(self._remove_device(uuid))
+
+        added = []
+        changes = []
+        for device_class, devices in devices_by_class.items():
+            class_added, class_changed = self._initialize_devices(device_class, devices)
+            added.extend(class_added)
+            # eg. after a reconnect, for what changed while the connection was down
+            for entity in class_changed:
+                entity._state_changed()
+                self._device_updated(entity, True)
+                if self._on_entities_changed is not None:
+                    fields = self._changed_fields(entity.uuid, self._device_snapshots[entity.uuid])
+                    if fields:
+                        changes.append((entity, fields))
+            if stale:
+                for entity in class_added:
+                    entity.stale = True
+            if first_list or class_added or class_changed or device_class in removed_classes \
+                    or device_class in stale_classes:
+                self._devices_changed(device_class)
+
+        if changes:
+            self._entities_changed(changes)
+        if added and not first_list:
+            self._on_devices_added(added)
+        if removed:
+            self._on_devices_removed(removed)
 
     def initialize_devices(self, device_class, actionable_devices):
+        self._initialize_devices(device_class, actionable_devices)
+        self._devices_changed(device_class)
 
-        base_devices = [x for x in actionable_devices if x[KEY_MODEL]
-                        in DEVICE_SETS[device_class][INTERNAL_KEY_MODELS]]
-        if device_class not in self._devices:
-            self._devices[device_class] = []
-        for base_device in base_devices:
-            if self._device_callbacks[base_device[KEY_UUID]] and self._device_callbacks[base_device[KEY_UUID]][
-                KEY_ENTITY] and \
-                    self._device_callbacks[base_device[KEY_UUID]][KEY_ENTITY].uuid:
-                self._device_callbacks[base_device[KEY_UUID]][KEY_ENTITY].update_dev(base_device)
+    def _initialize_devices(self, device_class, actionable_devices):
+        """Create or update the entities of device_class, returns the lists of added and changed entities."""
+        added = []
+        changed = []
+        for device in actionable_devices:
+            uuid = device[KEY_UUID]
+            if self._device_classes_by_model.get(device[KEY_MODEL]) != device_class \
+                    or self._device_snapshots.get(uuid) == device:
+                continue
+            previous = self._device_snapshots.get(uuid)
+            self._device_snapshots[uuid] = device
+            entity = self._devices.get(uuid)
+            if entity:
+                if previous is not None and self._on_entities_changed is not None:
+                    # The fields on_entities_changed compares with, before the snapshot is replaced
+                    self._reported_fields.setdefault(uuid, extract_reported_fields(previous))
+                if entity.update_dev(device):
+                    self._devices.update_model(entity)
+                    changed.append(entity)
             else:
-                self._device_callbacks[base_device[KEY_UUID]][KEY_ENTITY] = \
-                    DEVICE_SETS[device_class][INTERNAL_KEY_CLASS](base_device,
-                                                                  self._device_callbacks[
-                                                                      base_device[
-                                                                          KEY_UUID]],
-                                                                  self._client,
-                                                                  self._profile_creation_id,
-                                                                  self._add_device_control)
-                self._devices[device_class].append(self._device_callbacks[base_device[KEY_UUID]][KEY_ENTITY])
+                callback_container = {INTERNAL_KEY_CALLBACK: None, KEY_ENTITY: None,
+                                      INTERNAL_KEY_EXECUTOR: self._callback_executor,
+                                      INTERNAL_KEY_DEVICE_CONTROLS: self._add_device_controls,
+                                      INTERNAL_KEY_AVAILABLE: self._is_available}
+                entity = self._device_sets[device_class][INTERNAL_KEY_CLASS](device,
+                                                                           callback_container,
+                                                                           self._client,
+                                                                           self._profile_creation_id,
+                                                                           self._add_device_control)
+                callback_container[KEY_ENTITY] = entity
+                self._device_callbacks[uuid] = callback_container
+                self._devices.add(entity, device_class)
+                added.append(entity)
+        return added, changed
+
+    def _remove_device(self, uuid):
+        self._device_snapshots.pop(uuid, None)
+        self._reported_fields.pop(uuid, None)
+        self._device_callbacks.pop(uuid, None)
+        return self._devices.remove(uuid)
+
+    def _devices_changed(self, device_class):
         if device_class in self._devices_callback:
-            self._devices_callback[device_class](self._devices[device_class])
+            self._devices_callback[device_class](self._devices.by_device_class(device_class))
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+from collections import deque
+
+from .coco import CoCo
+from .coco_buffer_policy import CoCoBufferPolicy
+from .coco_callback_executor import CoCoCallbackExecutor
+from .const import DEVICE_CONTROL_CONFIRM_TIMEOUT, DEVICE_CONTROL_MAX_MESSAGE_SIZE, MQTT_MISC_LOOP_INTERVAL, \
+    MQTT_RC_CODES
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AsyncCoCo(CoCo):
+    """AsyncCoCo is a CoCo that runs entirely on an asyncio event loop.
+
+    The MQTT socket is driven by the event loop instead of paho's network thread,
+    and the device control buffer is flushed by a task instead of a thread.
+    Commands on the entities return a future that resolves (with the entity) once
+    the controller reports the state of that device, so one can
+    `await light.turn_on()`. All methods must be called from the event loop.
+    """
+
+    def __init__(self, address, username, password, port=8883, ca_path=None, switches_as_lights=False,
+                 confirm_timeout=DEVICE_CONTROL_CONFIRM_TIMEOUT, callback_executor=None, **kwargs):
+        self._loop = None
+        self._tasks = []
+        self._connected = None
+        self._connect_rc = None
+        self._reconnect_delay = 0
+        self._disconnected = None
+        self._closing = False
+        self._confirm_timeout = confirm_timeout
+        self._unpublished_confirmations = {}
+        self._pending_confirmations = {}
+        # Commands that found no room in a BLOCK buffer, the dispatcher adds them once there is
+        self._device_control_overflow = deque()
+        self._change_queues = []
+        # By default the callbacks are scheduled on the event loop, see connect
+        self._callback_executor_on_loop = callback_executor is None
+        if callback_executor is None:
+            callback_executor = CoCoCallbackExecutor(max_workers=0)
+        super().__init__(address, username, password, port=port, ca_path=ca_path,
+                         switches_as_lights=switches_as_lights, callback_executor=callback_executor, **kwargs)
+
+    async def connect(self):
+        """Connect to the controller and return once the connection is accepted."""
+        self._loop = asyncio.get_running_loop()
+        self._connected = asyncio.Event()
+        self._disconnected = asyncio.Event()
+        self._device_control_event = asyncio.Event()
+        if self._callback_executor_on_loop:
+            self._callback_executor.set_loop(self._loop)
+        self._load_cache()
+        self._attach_client_callbacks()
+        self._client.on_socket_open = self._on_socket_open
+        self._client.on_socket_close = self._on_socket_close
+        self._client.on_socket_register_write = self._on_socket_register_write
+        self._client.on_socket_unregister_write = self._on_socket_unregister_write
+        self._client.connect_async(self._address, self._port)
+        self._tasks = [self._loop.create_task(self._misc_loop()),
+                       self._loop.create_task(self._dispatch_device_control_commands())]
+        await self._connected.wait()
+        if self._connect_rc != 0:
+            await self.disconnect()
+            raise Exception(MQTT_RC_CODES[self._connect_rc] if self._connect_rc < len(MQTT_RC_CODES)
+                            else 'Unknown error')
+
+    async def disconnect(self):
+        self._closing = True
+        self._client.disconnect()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def changes(self):
+        """Asynchronously iterate over the entities whose state changed."""
+        queue = asyncio.Queue()
+        self._change_queues.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._change_queues.remove(queue)
+
+    def _start_device_control_dispatcher(self):
+        # The dispatcher is a task, started on connect
+        pass
+
+    def _add_device_control(self, uuid, property_key, property_value):
+        return self._add_device_controls({uuid: {property_key: property_value}})
+
+    def _add_device_controls(self, commands):
+        # Never block the event loop on a full buffer, publish what we have instead
+        buffer = self._device_control_buffer
+        if self._device_control_overflow or not buffer.has_room_for(commands):
+            self._flush_device_control_buffer()
+        if buffer.policy == CoCoBufferPolicy.BLOCK and (self._device_control_overflow
+                                                        or not buffer.has_room_for(commands)):
+            # The buffered devices are all rate limited, BLOCK would wait for a flush that can't run
+            buffer.count_throttled()
+            self._device_control_overflow.append(commands)
+        else:
+            buffer.add_commands(commands)
+        self._device_control_event.set()
+        futures = [self._confirmation(uuid) for uuid in commands]
+        return futures[0] if len(futures) == 1 else asyncio.gather(*futures)
+
+    def control_many(self, commands, max_message_size=DEVICE_CONTROL_MAX_MESSAGE_SIZE):
+        """Like CoCo.control_many, returns a future that resolves once the controller reported all devices."""
+        commands = self._device_commands(commands)
+        futures = [self._confirmation(uuid) for uuid in commands]
+        super().control_many(commands, max_message_size)
+        for uuid in commands:
+            self._pending_confirmations.setdefault(uuid, []).extend(self._unpublished_confirmations.pop(uuid, []))
+        return asyncio.gather(*futures)
+
+    def _take_device_commands(self, uuids):
+        commands, enqueue_times = super()._take_device_commands(uuids)
+        # Overflow commands are newer than the buffered ones
+        for overflow_commands in self._device_control_overflow:
+            for uuid in uuids:
+                if uuid in overflow_commands:
+                    commands = self._merge_device_commands(commands, {uuid: overflow_commands.pop(uuid)})
+        self._device_control_overflow = deque(commands for commands in self._device_control_overflow if commands)
+        return commands, enqueue_times
+
+    def _confirmation(self, uuid):
+        """A future for the next state the controller reports for uuid, once the command is published."""
+        future = self._loop.create_future()
+        timeout_handle = self._loop.call_later(self._confirm_timeout, self._confirmation_timed_out, future)
+        future.add_done_callback(lambda _: timeout_handle.cancel())
+        self._unpublished_confirmations.setdefault(uuid, []).append(future)
+        return future
+
+    async def _dispatch_device_control_commands(self):
+        while True:
+            await self._device_control_event.wait()
+            self._device_control_event.clear()
+            while not self._device_control_buffer.is_full():
+                command_count = len(self._device_control_buffer)
+                await asyncio.sleep(self._device_control_quiet_time)
+                if command_count == len(self._device_control_buffer):
+                    break
+            self._flush_device_control_buffer()
+            # Rate limited commands are left behind, they're published as soon as they may
+            delay = self._device_control_buffer.delay()
+            while delay is not None:
+                await asyncio.sleep(delay)
+                self._flush_device_control_buffer()
+                delay = self._device_control_buffer.delay()
+
+    def _flush_device_control_buffer(self):
+        batch = self._device_control_buffer.take_nowait()
+        self._add_device_control_overflow()
+        if batch is None:
+            return
+        # Only changes reported after publishing confirm a command
+        for uuid in batch[0]:
+            if uuid in self._unpublished_confirmations:
+                self._pending_confirmations.setdefault(uuid, []).extend(self._unpublished_confirmations.pop(uuid))
+        self._publish_device_control_batch(batch)
+
+    def _add_device_control_overflow(self):
+        buffer = self._device_control_buffer
+        while self._device_control_overflow and buffer.has_room_for(self._device_control_overflow[0]):
+            buffer.add_commands(self._device_control_overflow.popleft())
+
+    def _confirmation_timed_out(self, future):
+        if not future.done():
+            future.set_exception(asyncio.TimeoutError('The controller did not confirm the command in time'))
+
+    def _device_updated(self, entity, has_changed):
+        for future in self._pending_confirmations.pop(entity.uuid, []):
+            if not future.done():
+                future.set_result(entity)
+        if has_changed:
+            for queue in self._change_queues:
+                queue.put_nowait(entity)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        self._connect_rc = rc
+        self._connected.set()
+        super()._on_connect(client, userdata, flags, rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._connected.clear()
+        super()._on_disconnect(client, userdata, rc)
+
+    def _schedule_reconnect(self):
+        # The misc loop reconnects, wake it up
+        self._reconnect_delay = self._reconnect_backoff.next_delay()
+        self._call_in_loop(self._disconnected.set)
+
+    async def _misc_loop(self):
+        while not self._closing:
+            if self._client.socket() is None:
+                await asyncio.sleep(self._reconnect_delay)
+                try:
+                    # The TCP connect and TLS handshake block, keep them off the event loop
+                    await self._loop.run_in_executor(None, self._client.reconnect)
+                except (OSError, ValueError) as e:
+                    _LOGGER.warning('Could not connect to %s: %s', self._address, e)
+                    self._reconnect_delay = self._reconnect_backoff.next_delay()
+                continue
+            self._client.loop_misc()
+            try:
+                await asyncio.wait_for(self._disconnected.wait(), MQTT_MISC_LOOP_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._disconnected.clear()
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call_in_loop(self._loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call_in_loop(self._loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call_in_loop(self._loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call_in_loop(self._loop.remove_writer, sock)
+
+    def _call_in_loop(self, callback, *args):
+        # paho calls the socket callbacks from the executor thread while (re)connecting
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
@@ -0,0 +1,42 @@
+import random
+from time import monotonic
+
+from .const import MQTT_RECONNECT_DELAY, MQTT_RECONNECT_MAX_DELAY, MQTT_RECONNECT_STABLE_TIME
+
+
+class CoCoBackoff:
+    """CoCoBackoff hands out the delays between reconnection attempts.
+
+    They double with every attempt up to max_delay, and each one is picked at random between half
+    and all of it, so controllers that dropped together don't all come back at the same moment.
+    The attempts only start over once a connection lasted stable_time seconds, a flapping link
+    keeps backing off.
+    """
+
+    @property
+    def attempts(self):
+        return self._attempts
+
+    def __init__(self, delay=MQTT_RECONNECT_DELAY, max_delay=MQTT_RECONNECT_MAX_DELAY,
+                 stable_time=MQTT_RECONNECT_STABLE_TIME):
+        self._delay = delay
+        self._max_delay = max_delay
+        self._stable_time = stable_time
+        self._attempts = 0
+        self._connected_at = None
+
+    def connected(self):
+        self._connected_at = monotonic()
+
+    def next_delay(self):
+        if self._connected_at is not None:
+            if monotonic() - self._connected_at >= self._stable_time:
+                self._attempts = 0
+            self._connected_at = None
+        delay = min(self._max_delay, self._delay * 2 ** min(self._attempts, 32))
+        self._attempts += 1
+        return random.uniform(delay / 2, delay)
+
+    def reset(self):
+        self._attempts = 0
+        self._connected_at = None
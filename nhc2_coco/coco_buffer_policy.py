@@ -0,0 +1,8 @@
+from enum import Enum
+
+
+class CoCoBufferPolicy(Enum):
+    """What to do with a new command when the device control buffer is full."""
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop-oldest'
+    REJECT = 'reject'
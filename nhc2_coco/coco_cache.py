@@ -0,0 +1,95 @@
+import logging
+import os
+import re
+
+from . import codec
+from .const import CACHE_FORMAT_VERSION
+from .helpers import extract_system_info_version
+
+_LOGGER = logging.getLogger(__name__)
+
+_KEY_FORMAT = 'format'
+_KEY_SYSTEM_INFO = 'systemInfo'
+_KEY_DEVICES_LIST = 'devicesList'
+
+
+class CoCoCache:
+    """CoCoCache keeps the last systeminfo.publish and devices.list responses of a controller and profile on disk.
+
+    A CoCo builds its entities from it before it's connected. The cache is dropped when the controller
+    reports another software version or configuration than the cached one.
+    """
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def system_info(self):
+        return self._system_info
+
+    @property
+    def devices_list(self):
+        return self._devices_list
+
+    def __init__(self, directory, address, profile_creation_id):
+        file_name = re.sub(r'[^\w.-]', '_', '%s_%s' % (address, profile_creation_id)) + '.json'
+        self._path = os.path.join(directory, file_name)
+        self._system_info = None
+        self._devices_list = None
+
+    def load(self):
+        """Read the cache file, returns False when there is no usable cache."""
+        try:
+            with open(self._path, 'rb') as cache_file:
+                content = codec.loads(cache_file.read())
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            _LOGGER.warning('Ignoring unreadable device cache %s', self._path, exc_info=True)
+            return False
+        if not isinstance(content, dict) or content.get(_KEY_FORMAT) != CACHE_FORMAT_VERSION:
+            _LOGGER.info('Ignoring device cache %s, it has another format', self._path)
+            return False
+        self._system_info = content.get(_KEY_SYSTEM_INFO)
+        self._devices_list = content.get(_KEY_DEVICES_LIST)
+        return self._devices_list is not None
+
+    def is_valid_for(self, system_info):
+        """Whether the cached devices.list belongs to the controller that sent system_info."""
+        return self._system_info is not None \
+            and extract_system_info_version(self._system_info) == extract_system_info_version(system_info)
+
+    def save_system_info(self, system_info):
+        self._system_info = system_info
+        self._save()
+
+    def save_devices_list(self, devices_list):
+        self._devices_list = devices_list
+        self._save()
+
+    def invalidate(self):
+        self._system_info = None
+        self._devices_list = None
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            _LOGGER.warning('Failed to remove device cache %s', self._path, exc_info=True)
+
+    def _save(self):
+        content = codec.dumps({_KEY_FORMAT: CACHE_FORMAT_VERSION,
+                               _KEY_SYSTEM_INFO: self._system_info,
+                               _KEY_DEVICES_LIST: self._devices_list})
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        # Write next to the cache and swap, so a crash never leaves half a file behind
+        temp_path = self._path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            with open(temp_path, 'wb') as cache_file:
+                cache_file.write(content)
+            os.replace(temp_path, self._path)
+        except OSError:
+            _LOGGER.warning('Failed to write device cache %s', self._path, exc_info=True)
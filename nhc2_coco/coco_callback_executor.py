@@ -0,0 +1,176 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+from .coco_latency_stats import CoCoLatencyStats
+from .coco_trace_stage import CoCoTraceStage
+from .coco_tracer import trace_start, trace_end
+from .const import CALLBACK_EXECUTOR_WORKERS, SLOW_CALLBACK_TIME
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CoCoCallbackExecutor:
+    """CoCoCallbackExecutor runs the on_change callbacks of entities away from the MQTT network thread.
+
+    Callbacks run on a pool of max_workers threads, on an asyncio loop (see set_loop)
+    or inline when max_workers is 0. The callbacks of one entity never run concurrently
+    and run in order. When an entity changes again while its callback is still queued
+    or running, it is called once more afterwards instead of once per change.
+    Slow callbacks are logged and counted, errors are passed to on_error.
+    Other callbacks go through call(), they run one at a time in the order they're passed.
+    """
+
+    @property
+    def callback_time(self):
+        """Duration of the callbacks, see CoCoLatencyStats."""
+        return self._callback_time
+
+    @property
+    def slow_count(self):
+        return self._slow_count
+
+    @property
+    def error_count(self):
+        return self._error_count
+
+    @property
+    def on_error(self):
+        return self._on_error
+
+    @on_error.setter
+    def on_error(self, func):
+        self._on_error = func
+
+    def __init__(self, max_workers=CALLBACK_EXECUTOR_WORKERS, slow_callback_time=SLOW_CALLBACK_TIME):
+        self._max_workers = max_workers
+        # Created on first use, and again after a shutdown
+        self._pool = None
+        self._loop = None
+        self._slow_callback_time = slow_callback_time
+        self._lock = threading.Lock()
+        # uuid -> whether the callback has to run again once the current one is done
+        self._scheduled = {}
+        self._callback_time = CoCoLatencyStats()
+        self._slow_count = 0
+        self._error_count = 0
+        self._tracers = []
+        # The correlation id of what is being processed on a thread, and uuid -> the one of its scheduled callback
+        self._local = threading.local()
+        self._correlation_ids = {}
+        # (func, args) passed to call(), and whether they're being run
+        self._calls = deque()
+        self._calls_running = False
+        self._on_error = lambda entity, error: _LOGGER.error('on_change of %s (%s) failed', entity.name,
+                                                            entity.uuid, exc_info=error)
+
+    def set_loop(self, loop):
+        """Run the callbacks on this asyncio loop instead."""
+        self._loop = loop
+
+    def add_tracer(self, tracer):
+        # The list is replaced instead of changed, so a callback sees the same tracers start and end
+        if tracer not in self._tracers:
+            self._tracers = self._tracers + [tracer]
+
+    def remove_tracer(self, tracer):
+        self._tracers = [other for other in self._tracers if other is not tracer]
+
+    def set_correlation_id(self, correlation_id):
+        """The callbacks submitted from this thread are traced with correlation_id, until it's set again."""
+        self._local.correlation_id = correlation_id
+
+    def submit(self, entity):
+        with self._lock:
+            if self._tracers:
+                self._correlation_ids[entity.uuid] = getattr(self._local, 'correlation_id', None)
+            if entity.uuid in self._scheduled:
+                self._scheduled[entity.uuid] = True
+                return
+            self._scheduled[entity.uuid] = False
+        self._schedule(entity)
+
+    def call(self, func, *args):
+        """Run func(*args) like the on_change callbacks, after the calls passed before."""
+        with self._lock:
+            self._calls.append((func, args))
+            if self._calls_running:
+                return
+            self._calls_running = True
+        self._dispatch(self._run_call)
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads once the submitted callbacks ran, callbacks submitted later start new ones."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+    def _schedule(self, entity):
+        self._dispatch(self._run, entity)
+
+    def _dispatch(self, func, *args):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(func, *args)
+        elif self._max_workers:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(self._max_workers, thread_name_prefix='coco-callback')
+                pool = self._pool
+            pool.submit(func, *args)
+        else:
+            func(*args)
+
+    def _run_call(self):
+        with self._lock:
+            func, args = self._calls.popleft()
+        start = monotonic()
+        try:
+            func(*args)
+        except Exception:
+            with self._lock:
+                self._error_count += 1
+            _LOGGER.exception('%s failed', getattr(func, '__name__', func))
+        finally:
+            duration = monotonic() - start
+            self._callback_time.add(duration)
+            if duration > self._slow_callback_time:
+                with self._lock:
+                    self._slow_count += 1
+                _LOGGER.warning('%s took %.3f s', getattr(func, '__name__', func), duration)
+            with self._lock:
+                self._calls_running = bool(self._calls)
+                run_next = self._calls_running
+        if run_next:
+            self._dispatch(self._run_call)
+
+    def _run(self, entity):
+        tracers = self._tracers
+        if tracers:
+            with self._lock:
+                correlation_id = self._correlation_ids.pop(entity.uuid, None)
+            traced_at = trace_start(tracers, CoCoTraceStage.ON_CHANGE, correlation_id, {'uuid': entity.uuid})
+        start = monotonic()
+        try:
+            entity.on_change()
+        except Exception as e:
+            with self._lock:
+                self._error_count += 1
+            self._on_error(entity, e)
+        finally:
+            duration = monotonic() - start
+            if tracers:
+                trace_end(tracers, CoCoTraceStage.ON_CHANGE, correlation_id, traced_at)
+            self._callback_time.add(duration)
+            if duration > self._slow_callback_time:
+                with self._lock:
+                    self._slow_count += 1
+                _LOGGER.warning('on_change of %s (%s) took %.3f s', entity.name, entity.uuid, duration)
+            with self._lock:
+                run_again = self._scheduled.pop(entity.uuid)
+                if run_again:
+                    self._scheduled[entity.uuid] = False
+        if run_again:
+            self._schedule(entity)
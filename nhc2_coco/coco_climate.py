@@ -1,21 +1,16 @@
 import logging
 
-from .helpers import status_prop_in_object_is_on, extract_property_definitions, extract_property_value_from_device
-from .const import THERM_PROGRAM, THERM_OVERRULEACTION, THERM_OVERRULESETPOINT, THERM_OVERRULETIME, THERM_ECOSAVE
+from .helpers import status_prop_in_object_is_on, extract_property_definitions, extract_property_map
+from .const import THERM_PROGRAM, THERM_OVERRULEACTION, THERM_OVERRULESETPOINT, THERM_OVERRULETIME, THERM_ECOSAVE, \
+    TEMP_CELSIUS, HVAC_MODE_HEAT_COOL
 from .coco_entity import CoCoEntity
 
-from homeassistant.components.climate import (
-    TEMP_CELSIUS,
-    SUPPORT_TARGET_TEMPERATURE,
-    SUPPORT_TARGET_TEMPERATURE_RANGE,
-    SUPPORT_PRESET_MODE, 
-    HVAC_MODE_HEAT,
-    HVAC_MODE_HEAT_COOL
-)
-
 _LOGGER = logging.getLogger(__name__)
 
 class CoCoThermostat(CoCoEntity):
+    __slots__ = ('_state', '_current_temperature', '_target_temperature', '_target_temperature_low',
+                 '_target_temperature_high', '_target_temperature_step', '_min_temp', '_max_temp',
+                 '_preset_mode', '_preset_modes', '_hvac_mode', '_hvac_action', '_program')
 
     @property
     def state(self):
@@ -81,10 +76,18 @@ class CoCoThermostat(CoCoEntity):
 
     def __init__(self, dev, callback_container, client, profile_creation_id, command_device_control):
         super().__init__(dev, callback_container, client, profile_creation_id, command_device_control)
+        self._state = None
         self._current_temperature = None
         self._target_temperature = None
+        self._target_temperature_low = None
+        self._target_temperature_high = None
+        self._target_temperature_step = None
+        self._min_temp = None
+        self._max_temp = None
+        self._preset_modes = None
         self._preset_mode = None
         self._hvac_mode = None
+        self._hvac_action = None
         self._program = None
         self.update_dev(dev, callback_container)
 
@@ -100,14 +103,15 @@ class CoCoThermostat(CoCoEntity):
 
     def set_temperature(self, temperature):
         _LOGGER.info('Set temperature: %s', temperature)
-        self._command_device_control(self._uuid, THERM_OVERRULESETPOINT, str(temperature))
-        self._command_device_control(self._uuid, THERM_OVERRULETIME, str(480))
-        self._command_device_control(self._uuid, THERM_OVERRULEACTION, 'True')
+        # The overrule must not be activated before the controller has the setpoint
+        return self.control({THERM_OVERRULESETPOINT: str(temperature),
+                             THERM_OVERRULETIME: str(480),
+                             THERM_OVERRULEACTION: 'True'})
 
     def set_preset_mode(self, preset_mode):
         """Set preset mode."""
         _LOGGER.info('Set preset mode: %s', preset_mode)
-        self._command_device_control(self._uuid, THERM_PROGRAM, preset_mode)
+        return self._command_device_control(self._uuid, THERM_PROGRAM, preset_mode)
 
     def get_target_temperature_params(self, dev):
         """Get parameters for target temperature"""
@@ -135,12 +139,7 @@ class CoCoThermostat(CoCoEntity):
 
     def update_dev(self, dev, callback_container=None):
         has_changed = super().update_dev(dev, callback_container)
-        if self._check_for_status_change(dev):
-            self._current_temperature = float(extract_property_value_from_device(dev, 'AmbientTemperature'))
-            self._target_temperature = float(extract_property_value_from_device(dev, 'SetpointTemperature'))
-            self._preset_mode = extract_property_value_from_device(dev, 'Program')
-            self._hvac_mode = extract_property_value_from_device(dev, 'Demand')
-            self._hvac_action = extract_property_value_from_device(dev, 'Demand')
+        if self._check_for_status_change(extract_property_map(dev)):
             has_changed = True
         return has_changed
 
@@ -148,22 +147,25 @@ class CoCoThermostat(CoCoEntity):
         has_changed = self.update_dev(dev)
         if has_changed:
             self._state_changed()
+        return has_changed
 
-    def _check_for_status_change(self, dev):
-        status_value = extract_property_value_from_device(dev, 'AmbientTemperature')
-        if status_value and self._current_temperature != status_value:
+    def _check_for_status_change(self, properties):
+        has_changed = False
+        status_value = properties.get('AmbientTemperature')
+        if status_value and self._current_temperature != float(status_value):
             self._current_temperature = float(status_value)
             has_changed = True
-        status_value = extract_property_value_from_device(dev, 'SetpointTemperature')
-        if status_value and self._target_temperature != status_value:
+        status_value = properties.get('SetpointTemperature')
+        if status_value and self._target_temperature != float(status_value):
             self._target_temperature = float(status_value)
             has_changed = True
-        status_value = extract_property_value_from_device(dev, 'Program')
+        status_value = properties.get('Program')
         if status_value and self._preset_mode != status_value:
             self._preset_mode = status_value
             has_changed = True
-        status_value = extract_property_value_from_device(dev, 'Demand')
+        status_value = properties.get('Demand')
         if status_value and self._hvac_mode != status_value:
             self._hvac_mode = status_value
+            self._hvac_action = status_value
             has_changed = True
         return has_changed
@@ -0,0 +1,299 @@
+import threading
+from time import monotonic
+
+from .coco_buffer_policy import CoCoBufferPolicy
+from .const import DEVICE_CONTROL_BUFFER_SIZE, DEVICE_CONTROL_BUFFER_COMMAND_SIZE
+
+_NEVER = float('-inf')
+
+
+class CoCoDeviceControlBufferFull(Exception):
+    pass
+
+
+class CoCoDeviceControlBuffer:
+    """CoCoDeviceControlBuffer holds the device control commands waiting to be published.
+
+    It is bounded by the number of devices and the number of commands it holds.
+    A command for a device and property that is already waiting replaces the value
+    of that command (last write wins), it takes no extra room.
+    When a producer finds it full, the CoCoBufferPolicy decides what happens:
+    BLOCK waits (at most timeout seconds, if given) for the dispatcher to flush,
+    DROP_OLDEST discards the commands of the device that was queued first and
+    REJECT raises CoCoDeviceControlBufferFull, as does BLOCK when it times out or the buffer is closed.
+    With a rate_limit, the commands of a device are taken at most rate_limit times
+    per second, in between they stay in the buffer and keep being coalesced.
+    Commands added together with add_commands are taken together, with a rate_limit
+    that only holds per device.
+    """
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def on_add(self):
+        """Called, outside of the lock, after a command was added that wasn't coalesced."""
+        return self._on_add
+
+    @on_add.setter
+    def on_add(self, func):
+        self._on_add = func
+
+    @property
+    def throttled_count(self):
+        """Number of times a producer found the buffer full."""
+        return self._throttled_count
+
+    @property
+    def dropped_count(self):
+        """Number of commands discarded by DROP_OLDEST."""
+        return self._dropped_count
+
+    @property
+    def coalesced_count(self):
+        """Number of commands replaced by a later one for the same device and property."""
+        return self._coalesced_count
+
+    @property
+    def rejected_count(self):
+        """Number of commands refused by REJECT or a BLOCK timeout."""
+        return self._rejected_count
+
+    def __init__(self, size=DEVICE_CONTROL_BUFFER_SIZE, command_size=DEVICE_CONTROL_BUFFER_COMMAND_SIZE,
+                 policy=CoCoBufferPolicy.BLOCK, timeout=None, rate_limit=None):
+        self._size = size
+        self._command_size = command_size
+        self._policy = policy
+        self._timeout = timeout
+        self._min_interval = 1 / rate_limit if rate_limit else 0
+        # uuid -> when its commands were last taken, only kept with a rate_limit
+        self._taken_at = {}
+        self._condition = threading.Condition()
+        self._commands = {}
+        self._enqueue_times = {}
+        self._command_count = 0
+        self._closed = False
+        self._throttled_count = 0
+        self._dropped_count = 0
+        self._rejected_count = 0
+        self._coalesced_count = 0
+        self._on_add = None
+
+    def __len__(self):
+        with self._condition:
+            return self._command_count
+
+    def add(self, uuid, property_key, property_value):
+        with self._condition:
+            device_commands = self._commands.get(uuid)
+            if device_commands is not None and property_key in device_commands:
+                device_commands[property_key] = property_value
+                self._coalesced_count += 1
+                return
+            if self._is_full():
+                self._throttled_count += 1
+                self._make_room(lambda: not self._is_full())
+            self._command_count += 1
+            if uuid not in self._commands:
+                self._commands[uuid] = {}
+                self._enqueue_times[uuid] = []
+            self._commands[uuid][property_key] = property_value
+            self._enqueue_times[uuid].append(monotonic())
+            self._condition.notify_all()
+        if self._on_add is not None:
+            self._on_add()
+
+    def add_commands(self, commands):
+        """Add commands (uuid -> {property_key: property_value}) at once, they are taken together.
+
+        The properties of a device keep the given order. Without room for all of them, the policy applies
+        as for a single command, but an empty buffer always takes them.
+        """
+        with self._condition:
+            new_devices, new_commands = self._room_needed(commands)
+            if new_commands and not self._has_room(new_devices, new_commands):
+                self._throttled_count += 1
+                # Recomputed, dropping or taking devices of commands makes them need more room
+                self._make_room(lambda: self._has_room(*self._room_needed(commands)))
+            now = monotonic()
+            for uuid, properties in commands.items():
+                if uuid not in self._commands:
+                    self._commands[uuid] = {}
+                    self._enqueue_times[uuid] = []
+                device_commands = self._commands[uuid]
+                for property_key, property_value in properties.items():
+                    if property_key in device_commands:
+                        # Moved to the end, so the properties go out in the order they were given
+                        del device_commands[property_key]
+                        self._coalesced_count += 1
+                    else:
+                        self._command_count += 1
+                        self._enqueue_times[uuid].append(now)
+                    device_commands[property_key] = property_value
+            self._condition.notify_all()
+        if self._on_add is not None:
+            self._on_add()
+
+    def take(self, quiet_time):
+        """Block until commands are available and return them as (commands, enqueue_times).
+
+        Once the first command is in, keep collecting until the buffer is full or
+        no new command arrived for quiet_time seconds. Returns None once closed.
+        """
+        with self._condition:
+            if not self.wait(quiet_time):
+                return None
+            return self._take()
+
+    def wait(self, quiet_time):
+        """Like take, but return True once commands may be taken instead of taking them, False once closed."""
+        with self._condition:
+            while True:
+                self._condition.wait_for(lambda: self._commands or self._closed)
+                while not self._closed and not self._is_full():
+                    command_count = self._command_count
+                    self._condition.wait(quiet_time)
+                    if command_count == self._command_count:
+                        break
+                if self._closed:
+                    return False
+                delay = self._delay()
+                if delay <= 0:
+                    return True
+                self._condition.wait(delay)
+
+    def take_nowait(self):
+        """Return the commands that may be taken now as (commands, enqueue_times) or None when there are none."""
+        with self._condition:
+            if not self._commands or self._delay() > 0:
+                return None
+            return self._take()
+
+    def take_devices(self, uuids):
+        """Take the commands of uuids as (commands, enqueue_times), whatever the rate_limit.
+
+        With a rate_limit, these devices count as taken now, so their next commands wait for it.
+        """
+        with self._condition:
+            now = monotonic()
+            commands = {}
+            enqueue_times = []
+            for uuid in uuids:
+                if uuid in self._commands:
+                    commands[uuid] = self._commands.pop(uuid)
+                    times = self._enqueue_times.pop(uuid)
+                    enqueue_times.extend(times)
+                    self._command_count -= len(times)
+                if self._min_interval:
+                    self._taken_at[uuid] = now
+            self._condition.notify_all()
+            return commands, enqueue_times
+
+    def has_room_for(self, commands):
+        """Whether add_commands(commands) would find room for them right away."""
+        with self._condition:
+            new_devices, new_commands = self._room_needed(commands)
+            return not new_commands or self._has_room(new_devices, new_commands)
+
+    def has_command(self, uuid, property_key):
+        """Whether a command for property_key of uuid is waiting, adding another one would replace it."""
+        with self._condition:
+            return property_key in self._commands.get(uuid, ())
+
+    def delay(self):
+        """Seconds until (some of) the buffered commands may be taken, None when the buffer is empty."""
+        with self._condition:
+            if not self._commands:
+                return None
+            return max(0.0, self._delay())
+
+    def count_throttled(self):
+        """Count a producer that found the buffer full and kept its commands elsewhere."""
+        with self._condition:
+            self._throttled_count += 1
+
+    def is_full(self):
+        with self._condition:
+            return self._is_full()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _take(self):
+        if self._min_interval:
+            return self._take_rate_limited()
+        commands = self._commands
+        enqueue_times = [t for times in self._enqueue_times.values() for t in times]
+        self._commands = {}
+        self._enqueue_times = {}
+        self._command_count = 0
+        self._condition.notify_all()
+        return commands, enqueue_times
+
+    def _take_rate_limited(self):
+        now = monotonic()
+        commands = {}
+        enqueue_times = []
+        for uuid in list(self._commands):
+            if now - self._taken_at.get(uuid, _NEVER) >= self._min_interval:
+                commands[uuid] = self._commands.pop(uuid)
+                times = self._enqueue_times.pop(uuid)
+                enqueue_times.extend(times)
+                self._command_count -= len(times)
+                self._taken_at[uuid] = now
+        # Devices that may be taken again anyway are forgotten
+        for uuid in [uuid for uuid, taken_at in self._taken_at.items() if now - taken_at >= self._min_interval]:
+            del self._taken_at[uuid]
+        self._condition.notify_all()
+        return commands, enqueue_times
+
+    def _delay(self):
+        if not self._min_interval:
+            return 0
+        now = monotonic()
+        return min(self._taken_at.get(uuid, _NEVER) + self._min_interval - now
+                   for uuid in self._commands)
+
+    def _room_needed(self, commands):
+        new_devices = 0
+        new_commands = 0
+        for uuid, properties in commands.items():
+            device_commands = self._commands.get(uuid)
+            if device_commands is None:
+                new_devices += 1
+                new_commands += len(properties)
+            else:
+                new_commands += sum(1 for property_key in properties if property_key not in device_commands)
+        return new_devices, new_commands
+
+    def _has_room(self, new_devices, new_commands):
+        # An empty buffer takes anything, or commands added together could never be added
+        return not self._commands or (len(self._commands) + new_devices <= self._size
+                                      and self._command_count + new_commands <= self._command_size)
+
+    def _is_full(self):
+        return len(self._commands) >= self._size or self._command_count >= self._command_size
+
+    def _make_room(self, has_room):
+        if self._policy == CoCoBufferPolicy.REJECT:
+            self._rejected_count += 1
+            raise CoCoDeviceControlBufferFull('Device control buffer is full')
+        elif self._policy == CoCoBufferPolicy.DROP_OLDEST:
+            while not has_room():
+                oldest_uuid = next(iter(self._commands))
+                dropped = len(self._enqueue_times.pop(oldest_uuid))
+                del self._commands[oldest_uuid]
+                self._command_count -= dropped
+                self._dropped_count += dropped
+        else:
+            # Wake up the dispatcher so it flushes right away and wait for it to make room
+            self._condition.notify_all()
+            if not self._condition.wait_for(lambda: self._closed or has_room(), self._timeout):
+                self._rejected_count += 1
+                raise CoCoDeviceControlBufferFull('Timed out waiting for room in the device control buffer')
+            if self._closed:
+                self._rejected_count += 1
+                raise CoCoDeviceControlBufferFull('The device control buffer was closed while waiting for room')
@@ -0,0 +1,63 @@
+class CoCoDeviceRegistry:
+    """CoCoDeviceRegistry holds the entities of a CoCo, indexed by uuid, model and device class.
+
+    Lookups are dict based, so they don't depend on the size of the installation.
+    """
+
+    def __init__(self):
+        self._by_uuid = {}
+        self._by_model = {}
+        self._by_device_class = {}
+        self._device_classes = {}
+        # uuid -> the model it's indexed under, the entity's model can change afterwards
+        self._models = {}
+
+    def __len__(self):
+        return len(self._by_uuid)
+
+    def __iter__(self):
+        return iter(list(self._by_uuid.values()))
+
+    def __contains__(self, uuid):
+        return uuid in self._by_uuid
+
+    def get(self, uuid):
+        return self._by_uuid.get(uuid)
+
+    def by_model(self, model):
+        return list(self._by_model.get(model, {}).values())
+
+    def by_device_class(self, device_class):
+        return list(self._by_device_class.get(device_class, {}).values())
+
+    def device_class_of(self, uuid):
+        return self._device_classes.get(uuid)
+
+    def add(self, entity, device_class):
+        uuid = entity.uuid
+        if uuid in self._by_uuid:
+            self.remove(uuid)
+        self._by_uuid[uuid] = entity
+        self._device_classes[uuid] = device_class
+        self._models[uuid] = entity.model
+        self._by_model.setdefault(entity.model, {})[uuid] = entity
+        self._by_device_class.setdefault(device_class, {})[uuid] = entity
+
+    def remove(self, uuid):
+        entity = self._by_uuid.pop(uuid, None)
+        if entity is None:
+            return None
+        device_class = self._device_classes.pop(uuid)
+        self._by_model[self._models.pop(uuid)].pop(uuid, None)
+        self._by_device_class[device_class].pop(uuid, None)
+        return entity
+
+    def update_model(self, entity):
+        """Index entity under its model again, after an update changed it."""
+        uuid = entity.uuid
+        model = self._models.get(uuid)
+        if uuid not in self._by_uuid or model == entity.model:
+            return
+        self._by_model[model].pop(uuid, None)
+        self._models[uuid] = entity.model
+        self._by_model.setdefault(entity.model, {})[uuid] = entity
@@ -1,61 +1,114 @@
-import binascii
+import asyncio
 import select
-import threading
 import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
 import netifaces
 from getmac import get_mac_address
 
+from .const import DISCOVERY_PORT, DISCOVERY_TIMEOUT, DISCOVERY_QUIET_TIME, DISCOVERY_RESOLVE_WORKERS
+
 
 class CoCoDiscover:
     """CoCoDiscover will help you discover NHC2.
     It will also tell you about NHC1, but the result will differ.
 
-    You create CoCoDiscover, passing along a callback an the time you max want to wait.
-    By default we wait 3 seconds.
-    
+    You create CoCoDiscover, passing along a callback for every result and one for when it's done.
+
     For every result with matching header the callback is called,
     with the address, mac-address and a boolean if it's a NHC2.
-    """
+    With resolve_hostname, the host name (or None) is passed as fourth argument.
 
-    def __init__(self, on_discover, on_done):
-        self._get_broadcast_ips()
+    The discovery packet is sent on every ipv4 broadcast address. We keep listening for
+    quiet_time seconds after the last answer (longer when controllers answer slowly),
+    but never longer than timeout. Looking up mac-addresses and host names happens
+    in parallel, next to receiving answers.
+    """
 
-        self._thread = threading.Thread(target=self._scan_for_nhc)
+    def __init__(self, on_discover, on_done, resolve_hostname=False, timeout=DISCOVERY_TIMEOUT,
+                 quiet_time=DISCOVERY_QUIET_TIME):
         self._on_discover = on_discover
         self._on_done = on_done
+        self._resolve_hostname = resolve_hostname
+        self._timeout = timeout
+        self._quiet_time = quiet_time
+        self._thread = threading.Thread(target=self._scan_for_nhc, daemon=True)
         self._thread.start()
-        # If we discover one, we don't want to keep looking too long...
-        self._discovered_at_least_one = False
 
     def _get_broadcast_ips(self):
-        interfaces = netifaces.interfaces()
-        return filter(lambda x: x,
-                              map(lambda x: netifaces.ifaddresses(x).get(netifaces.AF_INET)[0].get('broadcast') if (
-                                      (netifaces.AF_INET in netifaces.ifaddresses(x))
-                                      and ('broadcast' in netifaces.ifaddresses(x).get(netifaces.AF_INET)[0])
-
-                              ) else None, interfaces))
+        broadcast_ips = []
+        for interface in netifaces.interfaces():
+            for address in netifaces.ifaddresses(interface).get(netifaces.AF_INET, []):
+                broadcast_ip = address.get('broadcast')
+                if broadcast_ip and broadcast_ip not in broadcast_ips:
+                    broadcast_ips.append(broadcast_ip)
+        return broadcast_ips
 
     def _scan_for_nhc(self):
         server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         server.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         """ We search for all broadcast ip4s, so that we don't only search the main interface """
-        broadcast_ips = self._get_broadcast_ips()
-        for broadcast_ip in broadcast_ips:
-            server.sendto(bytes([0x44]), (broadcast_ip, 10000))
+        for broadcast_ip in self._get_broadcast_ips():
+            server.sendto(bytes([0x44]), (broadcast_ip, DISCOVERY_PORT))
         server.setblocking(0)
-        loops = 0
 
-        while loops < 200 and ((not self._discovered_at_least_one) or loops < 20):
-            loops = loops + 1
-            ready = select.select([server], [], [], 0.01)
-            if ready[0]:
+        started_at = monotonic()
+        deadline = started_at + self._timeout
+        quiet_time = self._quiet_time
+        responders = set()
+        with ThreadPoolExecutor(DISCOVERY_RESOLVE_WORKERS, thread_name_prefix='coco-discover') as resolvers:
+            while True:
+                now = monotonic()
+                if now >= deadline:
+                    break
+                ready = select.select([server], [], [], deadline - now)
+                if not ready[0]:
+                    break
                 data, addr = server.recvfrom(4096)
-                if data[0] == 0x44:  # NHC2 Header
+                if data[0] == 0x44 and addr[0] not in responders:  # NHC2 Header
+                    responders.add(addr[0])
                     is_nhc2 = (len(data) >= 16) and (data[15] == 0x02)
-                    mac = get_mac_address(ip=addr[0])
-                    if self._on_discover:
-                        self._discovered_at_least_one = True
-                        self._on_discover(addr[0], mac, is_nhc2)
+                    resolvers.submit(self._resolve, addr[0], is_nhc2)
+                    # Slow answers mean there may be more to come: wait at least twice as long for the next one
+                    answered_at = monotonic()
+                    quiet_time = max(quiet_time, 2 * (answered_at - started_at))
+                    deadline = min(started_at + self._timeout, answered_at + quiet_time)
         server.close()
-        self._on_done()
\ No newline at end of file
+        self._on_done()
+
+    def _resolve(self, address, is_nhc2):
+        mac = get_mac_address(ip=address)
+        if self._on_discover is None:
+            return
+        if self._resolve_hostname:
+            try:
+                host = socket.gethostbyaddr(address)[0]
+            except (socket.herror, socket.gaierror):
+                host = None
+            self._on_discover(address, mac, is_nhc2, host)
+        else:
+            self._on_discover(address, mac, is_nhc2)
+
+
+async def discover(resolve_hostname=True, timeout=DISCOVERY_TIMEOUT, quiet_time=DISCOVERY_QUIET_TIME):
+    """Asynchronously iterate over (address, mac, is_nhc2, host) tuples, as soon as they are found."""
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue()
+    done = object()
+
+    def on_discover(*result):
+        if not resolve_hostname:
+            result = result + (None,)
+        loop.call_soon_threadsafe(results.put_nowait, result)
+
+    def on_done():
+        loop.call_soon_threadsafe(results.put_nowait, done)
+
+    CoCoDiscover(on_discover, on_done, resolve_hostname=resolve_hostname, timeout=timeout, quiet_time=quiet_time)
+    while True:
+        result = await results.get()
+        if result is done:
+            return
+        yield result
@@ -1,24 +1,31 @@
 import asyncio
-import socket
+import threading
 
 from nhc2_coco.coco_discover import CoCoDiscover
 from nhc2_coco.coco_profiles import CoCoProfiles
-
-loop = asyncio.get_event_loop()
+from nhc2_coco.const import PROFILES_TIMEOUT
 
 
 class CoCoDiscoverProfiles:
     """CoCoDiscover will help you discover NHC2 Profiles on all devices on the network. It will NOT find hobby
     profiles. The username then is provided by Niko (eg. hobby) This relies on not publicly documented API calls! It
     also broadcasts a UDP packet on all available (ipV4) broadcast addresses.
+
+    All controllers are asked for their profiles at the same time, so a scan takes as long as
+    the slowest controller (at most profiles_timeout seconds).
     """
 
-    def __init__(self, host=None):
+    def __init__(self, host=None, profiles_timeout=PROFILES_TIMEOUT):
+        self._profiles_timeout = profiles_timeout
         self._controllers_found = []
         self._profiles_found = []
-        self._done_scanning_profiles = asyncio.Event()
+        self._profiles_done_count = 0
+        self._profiles_done_lock = threading.Lock()
+        # Set from the discovery and profile threads, so not an asyncio.Event
+        self._done_scanning_profiles = threading.Event()
         if host is None:
-            CoCoDiscover(self._discover_controllers_callback, self._done_discovering_controllers_callback)
+            CoCoDiscover(self._discover_controllers_callback, self._done_discovering_controllers_callback,
+                         resolve_hostname=True)
         else:
             """If a host is provided, we only search for profiles."""
             self._search_for_one_host(host)
@@ -27,43 +34,38 @@ class CoCoDiscoverProfiles:
         self._done_scanning_profiles.set()
 
     async def _wait_until_done(self):
-        await self._done_scanning_profiles.wait()
+        await asyncio.get_running_loop().run_in_executor(None, self._done_scanning_profiles.wait)
 
     async def get_all_profiles(self):
         await self._wait_until_done()
         return self._profiles_found
 
-    def _discover_profiles_callback(self, address, mac, skip_host_search=False):
+    def _discover_profiles_callback(self, address, mac, host):
         def inner_function(profiles):
-            if skip_host_search is not True:
-                try:
-                    host = socket.gethostbyaddr(address)[0]
-                except:
-                    host = None
-            else:
-                host = None
             self._profiles_found.append((address, mac, profiles, host))
 
         return inner_function
 
     def _done_discovering_controllers_callback(self):
         if len(self._controllers_found) == 0:
-            loop.call_soon_threadsafe(callback=self._done)
+            self._done()
         for ctrl in self._controllers_found:
-            CoCoProfiles(self._discover_profiles_callback(ctrl[0], ctrl[1]), ctrl[0],
-                         self._done_discovering_profiles_callback)
+            CoCoProfiles.start(self._discover_profiles_callback(ctrl[0], ctrl[1], ctrl[2]), ctrl[0],
+                         self._done_discovering_profiles_callback, timeout=self._profiles_timeout)
 
     def _done_discovering_profiles_callback(self):
-        while len(self._controllers_found) != len(self._profiles_found):
-            time.sleep(1)
-        loop.call_soon_threadsafe(callback=self._done)
+        with self._profiles_done_lock:
+            self._profiles_done_count += 1
+            all_done = self._profiles_done_count == len(self._controllers_found)
+        if all_done:
+            self._done()
 
-    def _discover_controllers_callback(self, address, mac, is_nhc2):
+    def _discover_controllers_callback(self, address, mac, is_nhc2, host):
         if (is_nhc2):
-            self._controllers_found.append((address, mac))
+            self._controllers_found.append((address, mac, host))
 
     def _search_for_one_host(self, host):
-        self._controllers_found = [(host, None)]
+        self._controllers_found = [(host, None, None)]
         for ctrl in self._controllers_found:
-            CoCoProfiles(self._discover_profiles_callback(ctrl[0], ctrl[1], True), ctrl[0],
-                         self._done_discovering_profiles_callback)
+            CoCoProfiles.start(self._discover_profiles_callback(ctrl[0], ctrl[1], None), ctrl[0],
+                         self._done_discovering_profiles_callback, timeout=self._profiles_timeout)
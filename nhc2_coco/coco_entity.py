@@ -1,10 +1,19 @@
 import threading
 from abc import ABC, abstractmethod
 
-from nhc2_coco.const import KEY_NAME, CALLBACK_HOLDER_PROP, KEY_TYPE, KEY_MODEL, KEY_ONLINE, KEY_DISPLAY_NAME
+from nhc2_coco.const import KEY_NAME, CALLBACK_HOLDER_PROP, KEY_TYPE, KEY_MODEL, KEY_ONLINE, KEY_DISPLAY_NAME, \
+    INTERNAL_KEY_EXECUTOR, INTERNAL_KEY_DEVICE_CONTROLS, INTERNAL_KEY_AVAILABLE
 from nhc2_coco.helpers import dev_prop_changed
 
+# Guards the lazy creation of the per entity callback mutex
+_callback_mutex_creation = threading.Lock()
+
+
 class CoCoEntity(ABC):
+    # Entities are kept by the thousands, so they have no __dict__. Subclasses declare their own __slots__.
+    __slots__ = ('_client', '_profile_creation_id', '_uuid', '_name', '_online', '_model', '_type',
+                 '_command_device_control', '_command_device_controls', '_callback_mutex', '_callback_executor',
+                 '_on_change', '_callback_container', '_stale', '_available')
 
     @property
     def uuid(self):
@@ -16,6 +25,9 @@ class CoCoEntity(ABC):
 
     @property
     def online(self):
+        """False while the CoCo lost its connection to the controller, the device's reported Online otherwise."""
+        if self._online and self._available is not None and not self._available():
+            return False
         return self._online
 
     @property
@@ -30,12 +42,27 @@ class CoCoEntity(ABC):
     def profile_creation_id(self):
         return self._profile_creation_id
 
+    @property
+    def stale(self):
+        """True while the state comes from the device cache and the controller didn't confirm it yet."""
+        return self._stale
+
+    @stale.setter
+    def stale(self, stale):
+        self._stale = stale
+
     @property
     def on_change(self):
+        if self._on_change is None:
+            return self._no_on_change
         return self._on_change
 
     @on_change.setter
     def on_change(self, func):
+        if self._callback_mutex is None:
+            with _callback_mutex_creation:
+                if self._callback_mutex is None:
+                    self._callback_mutex = threading.RLock()
         with self._callback_mutex:
             self._on_change = func
 
@@ -48,12 +75,16 @@ class CoCoEntity(ABC):
         self._model = None
         self._type = None
         self._command_device_control = command_device_control
-        self._callback_mutex = threading.RLock()
-        self._on_change = (lambda: print('%s (%s) has no _on_change callback set!' % (self._name, self._uuid)))
-        self._callback_container = (
-            lambda: print('%s (%s) has no _callback_container callback set!' % (self._name, self._uuid)))
-        self._after_update_callback = (
-            lambda: print('%s (%s) has no _after_update_callback callback set!' % (self._name, self._uuid)))
+        # Set by the CoCo through the callback container, sends several properties in one message
+        self._command_device_controls = None
+        # Created when on_change is set for the first time
+        self._callback_mutex = None
+        self._callback_executor = None
+        self._on_change = None
+        self._callback_container = None
+        self._stale = False
+        # Set by the CoCo through the callback container, tells whether the controller is connected
+        self._available = None
 
     def update_dev(self, dev, callback_container=None):
         has_changed = False
@@ -77,11 +108,32 @@ class CoCoEntity(ABC):
             if CALLBACK_HOLDER_PROP in self._callback_container:
                 self._callback_container[CALLBACK_HOLDER_PROP] = self._update
                 has_changed = True
+            if INTERNAL_KEY_EXECUTOR in self._callback_container:
+                self._callback_executor = self._callback_container[INTERNAL_KEY_EXECUTOR]
+            if INTERNAL_KEY_DEVICE_CONTROLS in self._callback_container:
+                self._command_device_controls = self._callback_container[INTERNAL_KEY_DEVICE_CONTROLS]
+            if INTERNAL_KEY_AVAILABLE in self._callback_container:
+                self._available = self._callback_container[INTERNAL_KEY_AVAILABLE]
         return has_changed
 
+    def control(self, properties):
+        """Set several properties at once ({property_key: property_value}), in that order and in one message."""
+        if self._command_device_controls is None:
+            result = None
+            for property_key, property_value in properties.items():
+                result = self._command_device_control(self._uuid, property_key, property_value)
+            return result
+        return self._command_device_controls({self._uuid: properties})
+
     @abstractmethod
     def _update(self, dev):
         pass
 
+    def _no_on_change(self):
+        print('%s (%s) has no _on_change callback set!' % (self._name, self._uuid))
+
     def _state_changed(self):
-        self.on_change()
+        if self._callback_executor:
+            self._callback_executor.submit(self)
+        else:
+            self.on_change()
@@ -1,10 +1,11 @@
 from .coco_entity import CoCoEntity
 from .coco_fan_speed import CoCoFanSpeed
 from .const import KEY_FAN_SPEED
-from .helpers import extract_property_value_from_device
+from .helpers import extract_property_map
 
 
 class CoCoFan(CoCoEntity):
+    __slots__ = ('_fan_speed',)
 
     @property
     def fan_speed(self) -> CoCoFanSpeed:
@@ -16,11 +17,11 @@ class CoCoFan(CoCoEntity):
         self.update_dev(dev, callback_container)
 
     def change_speed(self, speed: CoCoFanSpeed):
-        self._command_device_control(self._uuid, KEY_FAN_SPEED, speed.value)
+        return self._command_device_control(self._uuid, KEY_FAN_SPEED, speed.value)
 
     def update_dev(self, dev, callback_container=None):
         has_changed = super().update_dev(dev, callback_container)
-        status_value = extract_property_value_from_device(dev, KEY_FAN_SPEED)
+        status_value = extract_property_map(dev).get(KEY_FAN_SPEED)
         if status_value and self._fan_speed != CoCoFanSpeed(status_value):
             self._fan_speed = CoCoFanSpeed(status_value)
             has_changed = True
@@ -30,3 +31,4 @@ class CoCoFan(CoCoEntity):
         has_changed = self.update_dev(dev)
         if has_changed:
             self._state_changed()
+        return has_changed
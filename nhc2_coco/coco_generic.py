@@ -1,9 +1,10 @@
 from .coco_entity import CoCoEntity
 from .const import KEY_BASICSTATE, VALUE_TRIGGERED, VALUE_ON, KEY_STATUS
-from .helpers import extract_property_value_from_device
+from .helpers import extract_property_map
 
 
 class CoCoGeneric(CoCoEntity):
+    __slots__ = ('_is_on',)
 
     @property
     def is_on(self):
@@ -15,14 +16,14 @@ class CoCoGeneric(CoCoEntity):
         self.update_dev(dev, callback_container)
 
     def turn_on(self):
-        self._command_device_control(self._uuid, KEY_BASICSTATE, VALUE_TRIGGERED)
+        return self._command_device_control(self._uuid, KEY_BASICSTATE, VALUE_TRIGGERED)
 
     def turn_off(self):
-        self._command_device_control(self._uuid, KEY_BASICSTATE, VALUE_TRIGGERED)
+        return self._command_device_control(self._uuid, KEY_BASICSTATE, VALUE_TRIGGERED)
 
     def update_dev(self, dev, callback_container=None):
         has_changed = super().update_dev(dev, callback_container)
-        status_value = extract_property_value_from_device(dev, KEY_BASICSTATE)
+        status_value = extract_property_map(dev).get(KEY_BASICSTATE)
         if status_value and self._is_on != (status_value == VALUE_ON):
             self._is_on = (status_value == VALUE_ON)
             has_changed = True
@@ -32,3 +33,4 @@ class CoCoGeneric(CoCoEntity):
         has_changed = self.update_dev(dev)
         if has_changed:
             self._state_changed()
+        return has_changed
@@ -0,0 +1,49 @@
+import threading
+from collections import deque
+
+from .const import LATENCY_SAMPLE_SIZE
+
+
+class CoCoLatencyStats:
+    """CoCoLatencyStats keeps a rolling window of latency samples (in seconds)
+    and reports percentiles over that window.
+    """
+
+    @property
+    def count(self):
+        return len(self._samples)
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    def __init__(self, size=LATENCY_SAMPLE_SIZE):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        with self._lock:
+            self._samples.append(value)
+
+    def merge(self, other):
+        """Add the samples of other, eg. to report over several CoCo's."""
+        with other._lock:
+            samples = list(other._samples)
+        with self._lock:
+            self._samples.extend(samples)
+
+    def percentile(self, percentile):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
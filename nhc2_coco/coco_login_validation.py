@@ -5,8 +5,6 @@ import paho.mqtt.client as mqtt
 
 from nhc2_coco.const import MQTT_PROTOCOL, MQTT_TRANSPORT
 
-loop = asyncio.get_event_loop()
-
 
 class CoCoLoginValidation:
     """ Validate one can login on the CoCo
@@ -33,6 +31,7 @@ class CoCoLoginValidation:
 
     async def check_connection(self, timeout=10):
         result_code = 0
+        loop = asyncio.get_running_loop()
         done_testing = asyncio.Event()
         client = self._generate_client()
 
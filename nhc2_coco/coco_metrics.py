@@ -0,0 +1,143 @@
+import threading
+from bisect import bisect_left
+
+from .const import METRICS_TIME_BUCKETS, METRICS_PENDING_ROUND_TRIPS
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+class CoCoMetrics:
+    """CoCoMetrics counts and times what goes through a CoCo, set it with coco.metrics = CoCoMetrics().
+
+    snapshot() returns everything as a dict: metric name -> {'type', 'help', 'samples'}, samples being
+    a list of (labels dict, value). A histogram value is a dict with 'buckets' [(upper bound, cumulative
+    count)], 'sum' and 'count'. Exporters take that snapshot, prometheus_text() is the one included.
+    Without metrics the CoCo only checks for None.
+    """
+
+    def __init__(self, buckets=METRICS_TIME_BUCKETS):
+        self._buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # name -> (type, help, labels -> value)
+        self._metrics = {}
+        # name -> (type, help, function returning the value), read on snapshot
+        self._callbacks = {}
+        # uuid -> when its last command was published, until the controller reports the change
+        self._published_at = {}
+        self._define(COUNTER, 'nhc2_messages_received_total', 'MQTT messages received, by topic and method')
+        self._define(HISTOGRAM, 'nhc2_decode_seconds', 'Time to decode the JSON of a message')
+        self._define(HISTOGRAM, 'nhc2_update_dev_seconds', 'Time to update an entity with a device event, by model')
+        self._define(COUNTER, 'nhc2_device_control_flushes_total', 'devices.control messages sent from the buffer')
+        self._define(COUNTER, 'nhc2_device_control_commands_total', 'Device control commands published')
+        self._define(HISTOGRAM, 'nhc2_device_control_round_trip_seconds',
+                     'Time from publishing a device control command to the devices.changed of that device')
+
+    def add_callback(self, name, help_text, func, metric_type=GAUGE):
+        """Report the value func() returns on every snapshot, eg. the depth of a queue."""
+        with self._lock:
+            self._callbacks[name] = (metric_type, help_text, func)
+
+    def message_received(self, topic, method, decode_time):
+        with self._lock:
+            self._inc('nhc2_messages_received_total', (('topic', topic), ('method', method or '')))
+            self._observe('nhc2_decode_seconds', (), decode_time)
+
+    def device_updated(self, model, update_time):
+        with self._lock:
+            self._observe('nhc2_update_dev_seconds', (('model', model or ''),), update_time)
+
+    def commands_published(self, uuids, published_at, flush=True):
+        with self._lock:
+            if flush:
+                self._inc('nhc2_device_control_flushes_total', ())
+            for uuid in uuids:
+                self._inc('nhc2_device_control_commands_total', ())
+                # Re-inserted, so the oldest ones go first when there are too many
+                self._published_at.pop(uuid, None)
+                self._published_at[uuid] = published_at
+            while len(self._published_at) > METRICS_PENDING_ROUND_TRIPS:
+                del self._published_at[next(iter(self._published_at))]
+
+    def device_changed(self, uuid, changed_at):
+        with self._lock:
+            published_at = self._published_at.pop(uuid, None)
+            if published_at is not None:
+                self._observe('nhc2_device_control_round_trip_seconds', (), changed_at - published_at)
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for name, (metric_type, help_text, values) in self._metrics.items():
+                samples = []
+                for labels, value in values.items():
+                    if metric_type == HISTOGRAM:
+                        counts, total, count = value
+                        cumulative = 0
+                        buckets = []
+                        for bound, bucket_count in zip(self._buckets + (float('inf'),), counts):
+                            cumulative += bucket_count
+                            buckets.append((bound, cumulative))
+                        value = {'buckets': buckets, 'sum': total, 'count': count}
+                    samples.append((dict(labels), value))
+                snapshot[name] = {'type': metric_type, 'help': help_text, 'samples': samples}
+            callbacks = list(self._callbacks.items())
+        for name, (metric_type, help_text, func) in callbacks:
+            snapshot[name] = {'type': metric_type, 'help': help_text, 'samples': [({}, func())]}
+        return snapshot
+
+    def prometheus(self):
+        return prometheus_text(self.snapshot())
+
+    def reset(self):
+        with self._lock:
+            for _, _, values in self._metrics.values():
+                values.clear()
+            self._published_at.clear()
+
+    def _define(self, metric_type, name, help_text):
+        self._metrics[name] = (metric_type, help_text, {})
+
+    def _inc(self, name, labels, value=1):
+        values = self._metrics[name][2]
+        values[labels] = values.get(labels, 0) + value
+
+    def _observe(self, name, labels, value):
+        values = self._metrics[name][2]
+        histogram = values.get(labels)
+        if histogram is None:
+            histogram = values[labels] = [[0] * (len(self._buckets) + 1), 0.0, 0]
+        histogram[0][bisect_left(self._buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def prometheus_text(snapshot):
+    """Format a CoCoMetrics snapshot in the Prometheus text exposition format."""
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append('# HELP %s %s' % (name, metric['help']))
+        lines.append('# TYPE %s %s' % (name, metric['type']))
+        for labels, value in metric['samples']:
+            if metric['type'] != HISTOGRAM:
+                lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+                continue
+            for bound, count in value['buckets']:
+                bucket_labels = dict(labels, le='+Inf' if bound == float('inf') else _number(bound))
+                lines.append('%s_bucket%s %d' % (name, _labels(bucket_labels), count))
+            lines.append('%s_sum%s %s' % (name, _labels(labels), _number(value['sum'])))
+            lines.append('%s_count%s %d' % (name, _labels(labels), value['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                          .replace('\n', '\\n'))
+                             for key, value in labels.items())
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,371 @@
+import heapq
+import itertools
+import logging
+import selectors
+import socket
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+import paho.mqtt.client as mqtt
+
+from .coco import CoCo
+from .coco_callback_executor import CoCoCallbackExecutor
+from .coco_latency_stats import CoCoLatencyStats
+from .const import CALLBACK_EXECUTOR_WORKERS, POOL_DISPATCH_WORKERS, MQTT_MISC_LOOP_INTERVAL, MQTT_PROTOCOL, \
+    MQTT_TRANSPORT
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CoCoPool:
+    """CoCoPool runs the connections of many controllers on a fixed set of threads.
+
+    One thread drives all MQTT sockets with a selector, dispatch_workers threads flush the
+    device control buffers and (re)connect, and one CoCoCallbackExecutor runs the on_change
+    callbacks of all controllers. Only the I/O thread reads and writes the sockets, what other
+    threads publish is written by it. Errors of one controller are logged and don't affect the others.
+
+    pool = CoCoPool()
+    coco = pool.add('192.168.1.2', 'abcdefgh-ijkl-mnop-qrst-uvwxyz012345', 'secret_password')
+    coco.connect()
+    ...
+    pool.close()
+    """
+
+    @property
+    def cocos(self):
+        with self._lock:
+            return list(self._cocos)
+
+    @property
+    def callback_executor(self):
+        return self._callback_executor
+
+    def __init__(self, dispatch_workers=POOL_DISPATCH_WORKERS, callback_workers=CALLBACK_EXECUTOR_WORKERS):
+        self._lock = threading.Lock()
+        self._cocos = []
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_receiver, self._wakeup_sender = socket.socketpair()
+        self._wakeup_receiver.setblocking(False)
+        self._wakeup_sender.setblocking(False)
+        self._selector.register(self._wakeup_receiver, selectors.EVENT_READ, None)
+        # Calls to run on the I/O thread and (when, sequence, callback, args) timers, only used on the I/O thread
+        self._calls = deque()
+        self._timers = []
+        self._timer_sequence = itertools.count()
+        self._executor = ThreadPoolExecutor(dispatch_workers, thread_name_prefix='coco-pool')
+        self._callback_executor = CoCoCallbackExecutor(max_workers=callback_workers)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='coco-pool-io', daemon=True)
+        self._thread.start()
+
+    def add(self, address, username, password, callback_executor=None, **kwargs):
+        """Create a CoCo that runs on this pool, it takes the same arguments as CoCo.
+
+        Without a callback_executor, its callbacks run on the one of the pool.
+        """
+        coco = _PooledCoCo(self, address, username, password,
+                           callback_executor=callback_executor or self._callback_executor, **kwargs)
+        self._remember(coco)
+        return coco
+
+    def remove(self, coco):
+        """Disconnect coco for good, closing its device control buffer and its own callback executor."""
+        coco.disconnect()
+        coco.device_control_buffer.close()
+        if coco.callback_executor is not self._callback_executor:
+            coco.callback_executor.shutdown(wait=False)
+
+    def close(self):
+        """Disconnect all controllers and stop the threads of the pool."""
+        for coco in self.cocos:
+            coco.disconnect()
+        self._call_soon(self._stop)
+        self._thread.join()
+        self._executor.shutdown()
+        self._callback_executor.shutdown()
+        self._selector.close()
+        self._wakeup_receiver.close()
+        self._wakeup_sender.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def metrics(self):
+        """Return the totals over all controllers of the pool as a dict."""
+        cocos = self.cocos
+        device_control_latency = CoCoLatencyStats(size=None)
+        buffers = [coco.device_control_buffer for coco in cocos]
+        for coco in cocos:
+            device_control_latency.merge(coco.device_control_latency)
+        callback_time = self._callback_executor.callback_time
+        return {
+            'controllers': len(cocos),
+            'connected': sum(1 for coco in cocos if coco.connected),
+            'devices': sum(len(coco.devices) for coco in cocos),
+            'buffered_commands': sum(len(buffer) for buffer in buffers),
+            'throttled_commands': sum(buffer.throttled_count for buffer in buffers),
+            'coalesced_commands': sum(buffer.coalesced_count for buffer in buffers),
+            'dropped_commands': sum(buffer.dropped_count for buffer in buffers),
+            'rejected_commands': sum(buffer.rejected_count for buffer in buffers),
+            'device_control_latency_p50': device_control_latency.p50,
+            'device_control_latency_p99': device_control_latency.p99,
+            'callback_time_p50': callback_time.p50,
+            'callback_time_p99': callback_time.p99,
+            'slow_callbacks': self._callback_executor.slow_count,
+            'callback_errors': self._callback_executor.error_count,
+        }
+
+    def _remember(self, coco):
+        with self._lock:
+            if coco not in self._cocos:
+                self._cocos.append(coco)
+
+    def _forget(self, coco):
+        with self._lock:
+            if coco in self._cocos:
+                self._cocos.remove(coco)
+
+    # Any thread
+
+    def _call_soon(self, callback, *args):
+        if threading.current_thread() is self._thread:
+            callback(*args)
+            return
+        self._calls.append((callback, args))
+        try:
+            self._wakeup_sender.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Already plenty of wake ups pending, or closed
+            pass
+
+    # I/O thread
+
+    def _call_later(self, delay, callback, *args):
+        heapq.heappush(self._timers, (monotonic() + delay, next(self._timer_sequence), callback, args))
+
+    def _stop(self):
+        self._running = False
+
+    def _run(self):
+        next_misc = monotonic()
+        while self._running:
+            now = monotonic()
+            timeout = next_misc - now
+            if self._timers:
+                timeout = min(timeout, self._timers[0][0] - now)
+            for key, mask in self._selector.select(max(0.0, timeout)):
+                if key.data is None:
+                    self._drain_wakeups()
+                else:
+                    self._handle_socket(key.data, key.fileobj, mask)
+            while self._calls:
+                callback, args = self._calls.popleft()
+                self._run_safely(callback, *args)
+            now = monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, callback, args = heapq.heappop(self._timers)
+                self._run_safely(callback, *args)
+            if now >= next_misc:
+                next_misc = now + MQTT_MISC_LOOP_INTERVAL
+                for coco in self.cocos:
+                    self._misc(coco, now)
+
+    def _run_safely(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            _LOGGER.exception('CoCoPool failed to run %s', callback)
+
+    def _drain_wakeups(self):
+        try:
+            while self._wakeup_receiver.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _handle_socket(self, coco, sock, mask):
+        client = coco._client
+        try:
+            if mask & selectors.EVENT_READ:
+                client.loop_read()
+                # TLS can hold on to data the selector doesn't know about
+                while client.socket() is sock and hasattr(sock, 'pending') and sock.pending():
+                    client.loop_read()
+            if mask & selectors.EVENT_WRITE and client.socket() is sock:
+                client.loop_write()
+        except Exception:
+            _LOGGER.exception('Failed to handle the connection to %s', coco._address)
+
+    def _write(self, coco):
+        try:
+            if coco._client.socket() is not None:
+                coco._client.loop_write()
+        except Exception:
+            _LOGGER.exception('Failed to write to %s', coco._address)
+
+    def _misc(self, coco, now):
+        if coco._client.socket() is not None:
+            coco._client.loop_misc()
+        elif coco._connect_requested and not coco._connecting and now >= coco._reconnect_at:
+            self._connect(coco)
+
+    def _connect(self, coco):
+        if coco._connecting or not coco._connect_requested or coco._client.socket() is not None:
+            return
+        coco._connecting = True
+        self._executor.submit(self._reconnect, coco)
+
+    def _register(self, coco, sock):
+        try:
+            self._selector.register(sock, selectors.EVENT_READ, coco)
+        except KeyError:
+            self._selector.modify(sock, selectors.EVENT_READ, coco)
+
+    def _set_events(self, coco, sock, events):
+        try:
+            self._selector.modify(sock, events, coco)
+        except (KeyError, ValueError):
+            # The socket was closed in the meantime
+            pass
+
+    def _unregister(self, sock):
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _schedule_flush(self, coco):
+        if coco.device_control_buffer.is_full():
+            self._executor.submit(self._flush, coco)
+        else:
+            self._call_later(coco._device_control_quiet_time, self._quiet_check, coco,
+                             len(coco.device_control_buffer))
+
+    def _quiet_check(self, coco, command_count):
+        buffer = coco.device_control_buffer
+        if buffer.is_full() or len(buffer) == command_count:
+            self._executor.submit(self._flush, coco)
+        else:
+            self._call_later(coco._device_control_quiet_time, self._quiet_check, coco, len(buffer))
+
+    # Dispatch workers
+
+    def _reconnect(self, coco):
+        try:
+            # The TCP connect and TLS handshake block, that's why they're done here
+            coco._client.reconnect()
+        except (OSError, ValueError) as e:
+            _LOGGER.warning('Could not connect to %s: %s', coco._address, e)
+            coco._schedule_reconnect()
+        finally:
+            coco._connecting = False
+
+    def _flush(self, coco):
+        coco._flush_scheduled = False
+        try:
+            coco._flush_device_control_buffer()
+        except Exception:
+            _LOGGER.exception('Failed to publish the device control commands for %s', coco._address)
+        # Rate limited commands, or commands added while flushing
+        delay = coco.device_control_buffer.delay()
+        if delay is not None and not coco._flush_scheduled:
+            coco._flush_scheduled = True
+            self._call_soon(self._call_later, delay, self._schedule_flush, coco)
+
+
+class _PooledCoCo(CoCo):
+    """A CoCo that leaves its network and device control dispatching to a CoCoPool."""
+
+    @property
+    def connected(self):
+        return self._connected
+
+    def __init__(self, pool, *args, **kwargs):
+        self._pool = pool
+        self._connected = False
+        self._connect_requested = False
+        self._connecting = False
+        self._reconnect_at = 0
+        self._flush_scheduled = False
+        super().__init__(*args, **kwargs)
+        self._device_control_buffer.on_add = self._device_control_added
+
+    def connect(self):
+        # Back in the pool after a disconnect, for its keepalives and reconnects
+        self._pool._remember(self)
+        self._load_cache()
+        self._attach_client_callbacks()
+        self._client.on_socket_open = self._on_socket_open
+        self._client.on_socket_close = self._on_socket_close
+        self._client.on_socket_register_write = self._on_socket_register_write
+        self._client.on_socket_unregister_write = self._on_socket_unregister_write
+        self._client.connect_async(self._address, self._port)
+        self._connect_requested = True
+        self._pool._call_soon(self._pool._connect, self)
+
+    def disconnect(self):
+        self._connect_requested = False
+        self._pool._forget(self)
+        self._client.disconnect()
+
+    def _create_client(self):
+        return _PooledClient(self, protocol=MQTT_PROTOCOL, transport=MQTT_TRANSPORT)
+
+    def _start_device_control_dispatcher(self):
+        # The pool flushes the buffer
+        pass
+
+    def _device_control_added(self):
+        if not self._flush_scheduled or self._device_control_buffer.is_full():
+            self._flush_scheduled = True
+            self._pool._call_soon(self._pool._schedule_flush, self)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        self._connected = rc == 0
+        super()._on_connect(client, userdata, flags, rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._connected = False
+        super()._on_disconnect(client, userdata, rc)
+
+    def _schedule_reconnect(self):
+        delay = self._reconnect_backoff.next_delay()
+        self._reconnect_at = monotonic() + delay
+        self._pool._call_soon(self._pool._call_later, delay, self._pool._connect, self)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._pool._call_soon(self._pool._register, self, sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._pool._call_soon(self._pool._unregister, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._pool._call_soon(self._pool._set_events, self, sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._pool._call_soon(self._pool._set_events, self, sock, selectors.EVENT_READ)
+
+
+class _PooledClient(mqtt.Client):
+    """A paho client that leaves its writes to the I/O thread of a CoCoPool.
+
+    Without a network thread of its own, paho writes on the thread that publishes. Those are the
+    dispatch workers and user threads, racing the I/O thread on the same TLS socket.
+    """
+
+    def __init__(self, coco, *args, **kwargs):
+        self._pooled_coco = coco
+        super().__init__(*args, **kwargs)
+
+    def loop_write(self, max_packets=1):
+        pool = self._pooled_coco._pool
+        if threading.current_thread() is pool._thread:
+            return super().loop_write(max_packets)
+        pool._call_soon(pool._write, self._pooled_coco)
+        return mqtt.MQTT_ERR_SUCCESS
@@ -1,18 +1,36 @@
-import json
 import os
-from time import sleep
+import threading
 
 import paho.mqtt.client as mqtt
 
-from nhc2_coco.const import MQTT_TOPIC_PUBLIC_AUTH_RSP, MQTT_PROTOCOL, MQTT_TRANSPORT, MQTT_TOPIC_PUBLIC_AUTH_CMD
+from nhc2_coco import codec
+from nhc2_coco.const import MQTT_TOPIC_PUBLIC_AUTH_RSP, MQTT_PROTOCOL, MQTT_TRANSPORT, MQTT_TOPIC_PUBLIC_AUTH_CMD, \
+    PROFILES_TIMEOUT
 
 
 class CoCoProfiles:
-    """CoCoDiscover will collect a list of profiles on a NHC2
+    """CoCoProfiles will collect a list of profiles on a NHC2
+
+    callback is called with the profiles as soon as the controller answers, with [] when the
+    connection is refused or with None when there is no answer within timeout.
+    done_discovering_profiles_callback is called right after that. Creating a CoCoProfiles blocks
+    until then, CoCoProfiles.start() returns right away and wait() blocks until then.
     """
 
-    def __init__(self, callback, address, done_discovering_profiles_callback, port=8883, ca_path=None):
+    def __init__(self, callback, address, done_discovering_profiles_callback, port=8883, ca_path=None,
+                 timeout=PROFILES_TIMEOUT):
+        self._start(callback, address, done_discovering_profiles_callback, port, ca_path, timeout)
+        self.wait()
+
+    @classmethod
+    def start(cls, callback, address, done_discovering_profiles_callback, port=8883, ca_path=None,
+              timeout=PROFILES_TIMEOUT):
+        """Like creating a CoCoProfiles, without blocking."""
+        profiles = cls.__new__(cls)
+        profiles._start(callback, address, done_discovering_profiles_callback, port, ca_path, timeout)
+        return profiles
 
+    def _start(self, callback, address, done_discovering_profiles_callback, port, ca_path, timeout):
         if ca_path is None:
             ca_path = os.path.dirname(os.path.realpath(__file__)) + '/coco_ca.pem'
         client = mqtt.Client(protocol=MQTT_PROTOCOL, transport=MQTT_TRANSPORT)
@@ -22,37 +40,50 @@ class CoCoProfiles:
         self._address = address
         self._callback = callback
         self._done_discovering_profiles_callback = done_discovering_profiles_callback
-        self._loop = 0
-        self._max_loop = 200
         self._port = port
+        self._finished = False
+        self._finished_lock = threading.Lock()
+        self._done = threading.Event()
+        self._timer = threading.Timer(timeout, self._finish, args=(None,))
+        self._timer.daemon = True
         self._client.on_message = self._on_message
         self._client.on_connect = self._on_connect
         self._client.connect_async(self._address, self._port)
         self._client.loop_start()
-        while self._max_loop > self._loop >= 0:
-            self._loop = self._loop + 1
-            sleep(0.05)
-        if self._loop > 0:
-            self._callback(None)
-        self._done_discovering_profiles_callback()
-        self._client.disconnect()
+        self._timer.start()
+
+    def wait(self, timeout=None):
+        """Block until the profiles are reported, returns False if that didn't happen within timeout."""
+        return self._done.wait(timeout)
+
+    def _finish(self, profiles):
+        with self._finished_lock:
+            if self._finished:
+                return
+            self._finished = True
+        self._timer.cancel()
+        try:
+            self._callback(profiles)
+            self._done_discovering_profiles_callback()
+        finally:
+            self._done.set()
+            self._client.disconnect()
+            self._client.loop_stop()
 
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             client.subscribe(MQTT_TOPIC_PUBLIC_AUTH_RSP, qos=1)
             client.publish(MQTT_TOPIC_PUBLIC_AUTH_CMD, '{"Method":"profiles.list"}', 1)
         else:
-            self._callback([])
-            self._loop = -100
+            self._finish([])
 
     def _on_message(self, client, userdata, message):
 
         topic = message.topic
-        response = json.loads(message.payload)
+        response = codec.loads(message.payload)
         if topic == MQTT_TOPIC_PUBLIC_AUTH_RSP \
                 and response.get('Method') == 'profiles.list' \
                 and 'Params' in response \
                 and (len(response.get('Params')) == 1) \
                 and 'Profiles' in response.get('Params')[0]:
-            self._loop = -1
-            self._callback(response.get('Params')[0].get('Profiles'))
+            self._finish(response.get('Params')[0].get('Profiles'))
@@ -0,0 +1,163 @@
+"""Record the MQTT traffic of a CoCo to a file and replay it through another CoCo, without a controller.
+
+A recording is a sequence of (offset, topic, payload), offset being the seconds since the first message.
+Paths ending in .gz are gzip compressed.
+"""
+import gzip
+import struct
+import threading
+from time import monotonic, sleep
+
+from . import codec
+
+_MAGIC = b'NHC2REC1'
+# offset, topic length, payload length
+_RECORD_HEADER = struct.Struct('!dHI')
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _to_bytes(payload):
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    if isinstance(payload, str):
+        return payload.encode('utf-8')
+    payload = codec.dumps(payload)
+    return payload.encode('utf-8') if isinstance(payload, str) else payload
+
+
+def write_recording(path, messages):
+    """Write (offset, topic, payload) tuples to path. Payloads that aren't bytes or str are JSON encoded."""
+    with _open(path, 'wb') as recording:
+        recording.write(_MAGIC)
+        for offset, topic, payload in messages:
+            topic = topic.encode('utf-8')
+            payload = _to_bytes(payload)
+            recording.write(_RECORD_HEADER.pack(offset, len(topic), len(payload)))
+            recording.write(topic)
+            recording.write(payload)
+
+
+def read_recording(path):
+    """Yield the (offset, topic, payload) tuples of the recording at path."""
+    with _open(path, 'rb') as recording:
+        if recording.read(len(_MAGIC)) != _MAGIC:
+            raise Exception('%s is not a NHC2 recording' % path)
+        while True:
+            header = recording.read(_RECORD_HEADER.size)
+            if not header:
+                return
+            offset, topic_length, payload_length = _RECORD_HEADER.unpack(header)
+            topic = recording.read(topic_length).decode('utf-8')
+            yield offset, topic, recording.read(payload_length)
+
+
+class CoCoRecorder:
+    """CoCoRecorder writes every message a CoCo receives to a recording.
+
+    coco.recorder = CoCoRecorder('session.rec.gz')
+    ...
+    coco.recorder.close()
+    """
+
+    @property
+    def message_count(self):
+        return self._message_count
+
+    def __init__(self, path):
+        self._path = path
+        self._file = _open(path, 'wb')
+        self._file.write(_MAGIC)
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._message_count = 0
+
+    def record(self, topic, payload):
+        now = monotonic()
+        topic = topic.encode('utf-8')
+        payload = _to_bytes(payload)
+        with self._lock:
+            if self._file is None:
+                return
+            if self._started_at is None:
+                self._started_at = now
+            self._file.write(_RECORD_HEADER.pack(now - self._started_at, len(topic), len(payload)))
+            self._file.write(topic)
+            self._file.write(payload)
+            self._message_count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class _ReplayedMessage:
+    # Stands in for the paho MQTTMessage
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class CoCoReplay:
+    """CoCoReplay feeds recorded messages to a CoCo, as if they arrived from the controller.
+
+    At full speed by default, with realtime=True the original timing is kept.
+    The CoCo doesn't need to be connected.
+    """
+
+    @property
+    def message_count(self):
+        return self._message_count
+
+    @property
+    def elapsed(self):
+        return self._elapsed
+
+    @property
+    def messages_per_second(self):
+        return self._message_count / self._elapsed if self._elapsed else 0.0
+
+    @property
+    def message_started_at(self):
+        """monotonic() at the start of the message being replayed, to measure latencies from."""
+        return self._message_started_at
+
+    def __init__(self, coco, messages, realtime=False):
+        self._coco = coco
+        self._messages = messages
+        self._realtime = realtime
+        self._message_count = 0
+        self._elapsed = 0.0
+        self._message_started_at = None
+
+    def run(self):
+        """Replay all messages, returns the number of messages replayed."""
+        recorded = read_recording(self._messages) if isinstance(self._messages, str) else self._messages
+        # Encoding is done up front, so it isn't part of what's measured
+        messages = [(offset, _ReplayedMessage(topic, _to_bytes(payload))) for offset, topic, payload in recorded]
+        on_message = self._coco._on_message
+        started_at = monotonic()
+        for offset, message in messages:
+            if self._realtime:
+                delay = started_at + offset - monotonic()
+                if delay > 0:
+                    sleep(delay)
+            self._message_started_at = monotonic()
+            on_message(None, None, message)
+            self._message_count += 1
+        self._elapsed = monotonic() - started_at
+        return self._message_count
@@ -1,9 +1,10 @@
 from .coco_entity import CoCoEntity
 from .const import KEY_POSITION, VALUE_OPEN, VALUE_STOP, VALUE_CLOSE, KEY_ACTION
-from .helpers import extract_property_value_from_device
+from .helpers import extract_property_map
 
 
 class CoCoShutter(CoCoEntity):
+    __slots__ = ('_position',)
 
     @property
     def position(self):
@@ -15,20 +16,23 @@ class CoCoShutter(CoCoEntity):
         self.update_dev(dev, callback_container)
 
     def open(self):
-        self._command_device_control(self._uuid, KEY_ACTION, VALUE_OPEN)
+        return self._command_device_control(self._uuid, KEY_ACTION, VALUE_OPEN)
 
     def stop(self):
-        self._command_device_control(self._uuid, KEY_ACTION, VALUE_STOP)
+        return self._command_device_control(self._uuid, KEY_ACTION, VALUE_STOP)
 
     def close(self):
-        self._command_device_control(self._uuid, KEY_ACTION, VALUE_CLOSE)
+        return self._command_device_control(self._uuid, KEY_ACTION, VALUE_CLOSE)
 
-    def set_position(self, position: int):
-        self._command_device_control(self._uuid, KEY_POSITION, str(position))
+    def set_position(self, position: int, action=None):
+        """Move to position, with action (eg. VALUE_STOP first) in the same message when given."""
+        if action is None:
+            return self._command_device_control(self._uuid, KEY_POSITION, str(position))
+        return self.control({KEY_ACTION: action, KEY_POSITION: str(position)})
 
     def update_dev(self, dev, callback_container=None):
         has_changed = super().update_dev(dev, callback_container)
-        position_value = extract_property_value_from_device(dev, KEY_POSITION)
+        position_value = extract_property_map(dev).get(KEY_POSITION)
         if position_value is not None and self._position != int(position_value):
             self._position = int(position_value)
             has_changed = True
@@ -38,3 +42,4 @@ class CoCoShutter(CoCoEntity):
         has_changed = self.update_dev(dev)
         if has_changed:
             self._state_changed()
+        return has_changed
@@ -0,0 +1,89 @@
+"""Synthetic NHC2 installations and the traffic they produce, to benchmark and load test without a controller.
+
+The mix of device models follows a typical home: mostly lights and dimmers, some sockets and shutters,
+a few fans, thermostats and generic actions.
+"""
+import random
+
+from .const import KEY_METHOD, KEY_PARAMS, KEY_DEVICES, KEY_UUID, KEY_NAME, KEY_MODEL, KEY_TYPE, KEY_ONLINE, \
+    KEY_PROPERTIES, KEY_STATUS, KEY_BRIGHTNESS, KEY_POSITION, KEY_FAN_SPEED, KEY_BASICSTATE, VALUE_ON, VALUE_OFF, \
+    VALUE_DIMMER, DEV_TYPE_ACTION, DEV_TYPE_THERMOSTAT, MQTT_METHOD_DEVICES_LIST, MQTT_METHOD_DEVICES_STATUS, \
+    MQTT_TOPIC_SUFFIX_RSP, MQTT_TOPIC_SUFFIX_EVT
+
+INSTALLATION_SIZES = (50, 500, 5000)
+
+# model -> share of the installation
+MODEL_MIX = (
+    ('light', 30),
+    (VALUE_DIMMER, 25),
+    ('socket', 10),
+    ('switched-generic', 5),
+    ('rolldownshutter', 10),
+    ('venetianblind', 3),
+    ('fan', 2),
+    ('switched-fan', 2),
+    ('thermostat', 5),
+    ('generic', 8),
+)
+
+FAN_SPEEDS = ('Low', 'Medium', 'High', 'Boost')
+PROGRAMS = ('Day', 'Night', 'Eco', 'Off')
+
+
+def synthetic_devices(count, seed=0):
+    """Return the devices of an installation with count devices, as listed by devices.list."""
+    rnd = random.Random(seed)
+    models = [model for model, _ in MODEL_MIX]
+    weights = [weight for _, weight in MODEL_MIX]
+    devices = []
+    for index in range(count):
+        model = rnd.choices(models, weights)[0]
+        device = {KEY_UUID: 'synthetic-%s-%05d' % (model, index),
+                  KEY_NAME: '%s %d' % (model, index),
+                  KEY_MODEL: model,
+                  KEY_TYPE: DEV_TYPE_THERMOSTAT if model == 'thermostat' else DEV_TYPE_ACTION,
+                  KEY_ONLINE: 'True'}
+        device[KEY_PROPERTIES] = synthetic_properties(model, rnd)
+        devices.append(device)
+    return devices
+
+
+def synthetic_properties(model, rnd):
+    """Return a random Properties list for a device of the given model."""
+    if model == 'light' or model == 'socket' or model == 'switched-generic' or model == 'switched-fan':
+        return [{KEY_STATUS: rnd.choice((VALUE_ON, VALUE_OFF))}]
+    if model == VALUE_DIMMER:
+        return [{KEY_STATUS: rnd.choice((VALUE_ON, VALUE_OFF))}, {KEY_BRIGHTNESS: str(rnd.randrange(0, 101))}]
+    if model == 'rolldownshutter' or model == 'venetianblind':
+        return [{KEY_POSITION: str(rnd.randrange(0, 101))}]
+    if model == 'fan':
+        return [{KEY_FAN_SPEED: rnd.choice(FAN_SPEEDS)}]
+    if model == 'thermostat':
+        setpoint = 16 + rnd.randrange(0, 13) / 2
+        return [{'AmbientTemperature': '%.1f' % (setpoint + rnd.uniform(-2, 2))},
+                {'SetpointTemperature': '%.1f' % setpoint},
+                {'Program': rnd.choice(PROGRAMS)},
+                {'Demand': rnd.choice(('Heating', 'None', 'Cooling'))},
+                {'OverruleActive': 'False'}, {'OverruleSetpoint': '0.0'}, {'OverruleTime': '0'}]
+    return [{KEY_BASICSTATE: rnd.choice((VALUE_ON, VALUE_OFF))}]
+
+
+def devices_list_response(devices):
+    return {KEY_METHOD: MQTT_METHOD_DEVICES_LIST, KEY_PARAMS: [{KEY_DEVICES: devices}]}
+
+
+def devices_status_event(devices):
+    return {KEY_METHOD: MQTT_METHOD_DEVICES_STATUS, KEY_PARAMS: [{KEY_DEVICES: devices}]}
+
+
+def synthetic_traffic(profile_creation_id, devices, events=1000, devices_per_event=1, interval=0.01, seed=0):
+    """Yield (offset, topic, message) for the devices.list of devices, followed by events devices.status
+    messages of random devices, interval seconds apart. Scenes are simulated with devices_per_event > 1.
+    """
+    rnd = random.Random(seed)
+    yield 0.0, profile_creation_id + MQTT_TOPIC_SUFFIX_RSP, devices_list_response(devices)
+    topic_evt = profile_creation_id + MQTT_TOPIC_SUFFIX_EVT
+    for index in range(events):
+        changed = [{KEY_UUID: device[KEY_UUID], KEY_PROPERTIES: synthetic_properties(device[KEY_MODEL], rnd)}
+                   for device in rnd.sample(devices, min(devices_per_event, len(devices)))]
+        yield (index + 1) * interval, topic_evt, devices_status_event(changed)
@@ -0,0 +1,17 @@
+from enum import Enum
+
+
+class CoCoTraceStage(Enum):
+    """The stages a CoCoTracer is told about, see CoCo.add_tracer."""
+    # A received message, from arrival until all its handlers are done
+    ARRIVAL = 'arrival'
+    DECODE = 'decode'
+    # Calling the handlers of the decoded message
+    ROUTING = 'routing'
+    # Updating one entity with the state of one device
+    UPDATE = 'update'
+    ON_CHANGE = 'on_change'
+    # Publishing a batch of device control commands, around ENCODE and PUBLISH
+    FLUSH = 'flush'
+    ENCODE = 'encode'
+    PUBLISH = 'publish'
@@ -0,0 +1,40 @@
+import logging
+from time import perf_counter
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CoCoTracer:
+    """CoCoTracer is told when each CoCoTraceStage starts and ends, add one with coco.add_tracer.
+
+    The stages of one message or one batch of commands share a correlation id, they nest on the
+    thread they run on. ON_CHANGE runs later, on the thread of the CoCoCallbackExecutor, with the
+    correlation id of the message that changed the entity. Override what you need, the default does nothing.
+    """
+
+    def start(self, stage, correlation_id, attributes):
+        """stage starts, attributes is a dict with eg. the topic, method or uuid."""
+        pass
+
+    def end(self, stage, correlation_id, duration):
+        """stage ended after duration seconds."""
+        pass
+
+
+def trace_start(tracers, stage, correlation_id, attributes):
+    """Tell tracers stage starts, returns the time to pass on to trace_end."""
+    for tracer in tracers:
+        try:
+            tracer.start(stage, correlation_id, attributes)
+        except Exception:
+            _LOGGER.exception('Tracer %s failed', tracer)
+    return perf_counter()
+
+
+def trace_end(tracers, stage, correlation_id, started):
+    duration = perf_counter() - started
+    for tracer in tracers:
+        try:
+            tracer.end(stage, correlation_id, duration)
+        except Exception:
+            _LOGGER.exception('Tracer %s failed', tracer)
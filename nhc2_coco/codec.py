@@ -0,0 +1,65 @@
+"""JSON encoding and decoding of MQTT payloads.
+
+orjson or ujson is used when installed, otherwise the standard library json.
+All backends decode the bytes payload as received from paho and encode to
+something paho can publish as is. Use use_backend() to pick one explicitly.
+"""
+import json
+
+BACKEND_ORJSON = 'orjson'
+BACKEND_UJSON = 'ujson'
+BACKEND_JSON = 'json'
+
+
+def _json_backend():
+    return json.loads, lambda obj: json.dumps(obj, separators=(',', ':'))
+
+
+def _ujson_backend():
+    import ujson
+    return ujson.loads, ujson.dumps
+
+
+def _orjson_backend():
+    import orjson
+    return orjson.loads, orjson.dumps
+
+
+BACKENDS = {
+    BACKEND_ORJSON: _orjson_backend,
+    BACKEND_UJSON: _ujson_backend,
+    BACKEND_JSON: _json_backend,
+}
+
+backend = None
+loads = None
+dumps = None
+
+
+def available_backends():
+    available = []
+    for name, load_backend in BACKENDS.items():
+        try:
+            load_backend()
+            available.append(name)
+        except ImportError:
+            pass
+    return available
+
+
+def use_backend(name=None):
+    """Switch to the named backend, or to the fastest installed one when name is None."""
+    global backend, loads, dumps
+    if name is None:
+        for name, load_backend in BACKENDS.items():
+            try:
+                loads, dumps = load_backend()
+                break
+            except ImportError:
+                pass
+    else:
+        loads, dumps = BACKENDS[name]()
+    backend = name
+
+
+use_backend()
@@ -21,6 +21,42 @@ LIST_VALID_GENERICS = ['generic']
 
 DEVICE_CONTROL_BUFFER_SIZE = 16
 DEVICE_CONTROL_BUFFER_COMMAND_SIZE = 32
+# Flush the device control buffer after this many seconds without new commands
+DEVICE_CONTROL_QUIET_TIME = 0.005
+# Max bytes of one devices.control payload sent by control_many, it splits larger groups
+DEVICE_CONTROL_MAX_MESSAGE_SIZE = 8192
+
+LATENCY_SAMPLE_SIZE = 1024
+# Upper bounds (in seconds) of the CoCoMetrics histograms, and the number of published commands it
+# keeps waiting for their devices.changed
+METRICS_TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+METRICS_PENDING_ROUND_TRIPS = 4096
+
+# Seconds AsyncCoCo waits for the controller to confirm a device control command
+DEVICE_CONTROL_CONFIRM_TIMEOUT = 5
+MQTT_MISC_LOOP_INTERVAL = 1
+MQTT_RECONNECT_DELAY = 1
+# Reconnect delays double up to MQTT_RECONNECT_MAX_DELAY seconds, they start over once a connection
+# lasted MQTT_RECONNECT_STABLE_TIME seconds
+MQTT_RECONNECT_MAX_DELAY = 60
+MQTT_RECONNECT_STABLE_TIME = 30
+# Seconds to wait for a controller to answer profiles.list
+PROFILES_TIMEOUT = 10
+
+DISCOVERY_PORT = 10000
+# Seconds to listen for controllers, and to keep listening after the last answer
+DISCOVERY_TIMEOUT = 2
+DISCOVERY_QUIET_TIME = 0.2
+DISCOVERY_RESOLVE_WORKERS = 8
+
+CALLBACK_EXECUTOR_WORKERS = 4
+# Threads a CoCoPool uses to flush device control buffers and to (re)connect
+POOL_DISPATCH_WORKERS = 2
+# on_change callbacks taking longer than this many seconds are logged
+SLOW_CALLBACK_TIME = 0.1
+
+# Bumped when the layout of the device cache files changes, older files are ignored
+CACHE_FORMAT_VERSION = 1
 
 KEY_ACTION = 'Action'
 KEY_BRIGHTNESS = 'Brightness'
@@ -39,6 +75,10 @@ KEY_STATUS = 'Status'
 KEY_TYPE = 'Type'
 KEY_UUID = 'Uuid'
 KEY_BASICSTATE = "BasicState"
+KEY_PROFILES = 'Profiles'
+KEY_SYSTEM_INFO = 'SystemInfo'
+KEY_SW_VERSIONS = 'SWversions'
+KEY_LAST_CONFIG = 'LastConfig'
 
 VALUE_ON = 'On'
 VALUE_OFF = 'Off'
@@ -53,14 +93,23 @@ THERM_OVERRULESETPOINT = 'OverruleSetpoint'
 THERM_OVERRULETIME = 'OverruleTime'
 THERM_ECOSAVE = 'EcoSave'
 
+# Same values as homeassistant.components.climate, without having to import Home Assistant
+TEMP_CELSIUS = '°C'
+HVAC_MODE_HEAT_COOL = 'heat_cool'
+
 DEV_TYPE_ACTION = 'action'
+DEV_TYPE_THERMOSTAT = 'thermostat'
 
 INTERNAL_KEY_CALLBACK = 'callbackHolder'
 INTERNAL_KEY_MODELS = 'models'
 INTERNAL_KEY_CLASS = 'class'
+INTERNAL_KEY_EXECUTOR = 'executor'
+INTERNAL_KEY_DEVICE_CONTROLS = 'deviceControls'
+INTERNAL_KEY_AVAILABLE = 'available'
 
 CALLBACK_HOLDER_PROP = 'callbackHolder'
 
+MQTT_METHOD_PROFILES_LIST = 'profiles.list'
 MQTT_METHOD_SYSINFO_PUBLISH = 'systeminfo.publish'
 MQTT_METHOD_SYSINFO_PUBLISHED = 'systeminfo.published'
 MQTT_METHOD_DEVICES_LIST = 'devices.list'
@@ -1,4 +1,5 @@
-from nhc2_coco.const import KEY_DEVICES, KEY_PARAMS, KEY_PROPERTIES, KEY_UUID, KEY_METHOD, MQTT_METHOD_DEVICES_CONTROL
+from nhc2_coco.const import KEY_DEVICES, KEY_PARAMS, KEY_PROPERTIES, KEY_UUID, KEY_METHOD, MQTT_METHOD_DEVICES_CONTROL, \
+    KEY_SYSTEM_INFO, KEY_SW_VERSIONS, KEY_LAST_CONFIG, KEY_ONLINE, KEY_NAME, KEY_DISPLAY_NAME
 
 
 def extract_devices(response):
@@ -11,11 +12,32 @@ def extract_property_value_from_device(device, property_key):
     if device and KEY_PROPERTIES in device:
         properties = device[KEY_PROPERTIES]
         if properties:
-            property_object = next(filter((lambda x: x and property_key in x), properties), None)
-            if property_object and property_key in property_object:
-                return property_object[property_key]
+            for property_object in properties:
+                if property_object and property_key in property_object:
+                    return property_object[property_key]
     return None
 
+
+def extract_property_map(device):
+    """Flatten the Properties list of a device into one dict. The first occurrence of a key wins."""
+    property_map = {}
+    if device and KEY_PROPERTIES in device:
+        properties = device[KEY_PROPERTIES]
+        if properties:
+            for property_object in reversed(properties):
+                if property_object:
+                    property_map.update(property_object)
+    return property_map
+
+
+def extract_reported_fields(device):
+    """The property map of a device, with Online, Name and DisplayName when it has them."""
+    fields = extract_property_map(device)
+    for key in (KEY_ONLINE, KEY_NAME, KEY_DISPLAY_NAME):
+        if key in device:
+            fields[key] = device[key]
+    return fields
+
 def extract_property_definitions(response, parameter):
     if response and 'PropertyDefinitions' in response:
         properties = response['PropertyDefinitions']
@@ -43,3 +65,13 @@ def process_device_commands(device_commands_to_process):
             KEY_DEVICES: devices
         }]
     }
+
+
+def extract_system_info_version(response):
+    """The parts of a systeminfo.publish response that change when the controller is updated or reconfigured."""
+    for param in response.get(KEY_PARAMS) or []:
+        if param and param.get(KEY_SYSTEM_INFO):
+            system_info = param[KEY_SYSTEM_INFO][0]
+            return {KEY_SW_VERSIONS: system_info.get(KEY_SW_VERSIONS),
+                    KEY_LAST_CONFIG: system_info.get(KEY_LAST_CONFIG)}
+    return None
@@ -0,0 +1,48 @@
+import timeit
+
+from nhc2_coco import codec
+from nhc2_coco.helpers import process_device_commands
+
+"""
+ Compares the installed JSON backends on payloads shaped like the ones a NHC2 sends and receives:
+ a devices.list with property definitions, a devices.status burst and a devices.control flush.
+"""
+DEVICES = 400
+
+
+def listed_device(i):
+    return {'Uuid': 'c0ffee00-0000-0000-0000-%012d' % i, 'Type': 'action', 'Technology': 'nikohomecontrol',
+            'Model': 'dimmer', 'Identifier': '%08d' % i, 'Name': 'Dimmer %d' % i, 'Online': 'True',
+            'Traits': [], 'Parameters': [{'LocationId': 'location-%d' % (i % 12)}, {'LocationName': 'Room'}],
+            'Properties': [{'Status': 'Off'}, {'Brightness': '0'}, {'Aligned': 'True'}],
+            'PropertyDefinitions': [{'Status': {'HasStatus': 'true', 'CanControl': 'true',
+                                                'Description': 'Choice(On,Off)'}},
+                                    {'Brightness': {'HasStatus': 'true', 'CanControl': 'true',
+                                                    'Description': 'Range(0,100,1)'}}]}
+
+
+def status_device(i):
+    return {'Uuid': 'c0ffee00-0000-0000-0000-%012d' % i,
+            'Properties': [{'Status': 'On'}, {'Brightness': str(i % 100)}]}
+
+
+payloads = {
+    'devices.list': codec.dumps({'Method': 'devices.list',
+                                 'Params': [{'Devices': [listed_device(i) for i in range(DEVICES)]}]}),
+    'devices.status': codec.dumps({'Method': 'devices.status',
+                                   'Params': [{'Devices': [status_device(i) for i in range(DEVICES)]}]}),
+}
+payloads = {name: payload if isinstance(payload, bytes) else payload.encode() for name, payload in payloads.items()}
+control = process_device_commands({'c0ffee00-0000-0000-0000-%012d' % i: {'Status': 'On', 'Brightness': '50'}
+                                   for i in range(16)})
+
+runs = 50
+print('%-8s %-16s %10s' % ('backend', 'payload', 'us/op'))
+for backend in codec.available_backends():
+    codec.use_backend(backend)
+    for name, payload in payloads.items():
+        best = min(timeit.repeat(lambda: codec.loads(payload), number=runs, repeat=5)) / runs
+        print('%-8s %-16s %10.1f' % (backend, 'loads ' + name, best * 1e6))
+    best = min(timeit.repeat(lambda: codec.dumps(control), number=runs * 100, repeat=5)) / (runs * 100)
+    print('%-8s %-16s %10.1f' % (backend, 'dumps control', best * 1e6))
+codec.use_backend()
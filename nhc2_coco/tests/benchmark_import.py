@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+"""
+ Import-time regression guard: runs `python -X importtime -c "import nhc2_coco"` in a fresh
+ interpreter, prints the slowest imports and exits with 1 when Home Assistant (or asyncio, which
+ only AsyncCoCo needs) gets imported, or when the import takes longer than the budget.
+"""
+BUDGET_MS = 150
+FORBIDDEN = ('homeassistant', 'asyncio')
+
+result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import nhc2_coco'],
+                        stderr=subprocess.PIPE, universal_newlines=True)
+imports = []
+for line in result.stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+        continue
+    self_us, cumulative_us, name = line[len('import time:'):].split('|')
+    imports.append((int(self_us), int(cumulative_us), name.strip()))
+
+if result.returncode != 0 or not imports:
+    print(result.stderr)
+    sys.exit(1)
+
+total_ms = next(cumulative for _, cumulative, name in imports if name == 'nhc2_coco') / 1000
+print('import nhc2_coco: %.1f ms (budget %d ms)' % (total_ms, BUDGET_MS))
+print('slowest imports (self time):')
+for self_us, cumulative_us, name in sorted(imports, reverse=True)[:10]:
+    print('  %8.1f ms  %s' % (self_us / 1000, name))
+
+forbidden = sorted(name for _, _, name in imports if name.split('.')[0] in FORBIDDEN)
+if forbidden:
+    print('Imported, but should not be: %s' % ', '.join(forbidden))
+if forbidden or total_ms > BUDGET_MS:
+    sys.exit(1)
@@ -0,0 +1,54 @@
+import threading
+import time
+
+from nhc2_coco import CoCo
+
+"""
+ Measures device control throughput with several CoCo instances in one process.
+ No controller is needed: publish is replaced by a counter, so this only measures
+ the buffering and dispatching done by the library.
+"""
+COMMANDS_PER_INSTANCE = 20000
+
+
+def run(instance_count):
+    cocos = [CoCo('127.0.0.1', 'user-%d' % i, 'password') for i in range(instance_count)]
+    published = [0] * instance_count
+    all_published = threading.Event()
+    counter_lock = threading.Lock()
+
+    def counting_publish(index):
+        def publish(topic, payload, qos):
+            with counter_lock:
+                # bytes with orjson, str with the other codecs
+                published[index] += payload.count(b'"Uuid"' if isinstance(payload, bytes) else '"Uuid"')
+                if sum(published) >= instance_count * COMMANDS_PER_INSTANCE:
+                    all_published.set()
+        return publish
+
+    for i, coco in enumerate(cocos):
+        coco._client.publish = counting_publish(i)
+
+    def produce(coco):
+        for j in range(COMMANDS_PER_INSTANCE):
+            # Every command targets another device, so none get merged
+            coco._add_device_control('device-%d' % j, 'Status', 'On')
+
+    producers = [threading.Thread(target=produce, args=(coco,)) for coco in cocos]
+    start = time.perf_counter()
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    all_published.wait(60)
+    elapsed = time.perf_counter() - start
+    p99s = [coco.device_control_latency.p99 for coco in cocos]
+    for coco in cocos:
+        coco.device_control_buffer.close()
+    return sum(published) / elapsed, max(p99s) * 1000
+
+
+print('instances  commands/s  worst p99 (ms)')
+for count in (1, 2, 4, 8):
+    throughput, p99 = run(count)
+    print('%9d  %10.0f  %14.2f' % (count, throughput, p99))
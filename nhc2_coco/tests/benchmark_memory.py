@@ -0,0 +1,109 @@
+import threading
+import tracemalloc
+
+from nhc2_coco.coco import DEVICE_SETS
+from nhc2_coco.coco_entity import CoCoEntity
+from nhc2_coco.const import INTERNAL_KEY_CLASS, INTERNAL_KEY_MODELS, INTERNAL_KEY_CALLBACK, KEY_ENTITY, KEY_NAME, \
+    KEY_ONLINE, KEY_MODEL, KEY_TYPE
+
+"""
+ Reports the memory used per entity for every device class in DEVICE_SETS, including the
+ callback container CoCo keeps next to it. Entities are built from a devices.list style dict.
+ The legacy column is LegacyEntity, which mirrors the entities before they were slotted.
+"""
+ENTITIES = 10000
+
+
+def device(i, model):
+    return {'Uuid': 'c0ffee00-0000-0000-0000-%012d' % i, 'Type': 'action', 'Model': model,
+            'Name': 'Device %d' % i, 'Online': 'True', 'Properties': []}
+
+
+def command_device_control(uuid, property_key, property_value):
+    pass
+
+
+class LegacyEntity:
+    """An entity as it was before the entities were slotted: attributes in a __dict__, an RLock and
+    lambdas per instance, created in __init__ as CoCoEntity did then."""
+
+    _attributes = ()
+
+    def __init__(self, dev, callback_container, client, profile_creation_id, command_device_control):
+        self._client = client
+        self._profile_creation_id = profile_creation_id
+        self._uuid = dev['Uuid']
+        self._name = None
+        self._online = None
+        self._model = None
+        self._type = None
+        self._command_device_control = command_device_control
+        self._callback_mutex = threading.RLock()
+        self._on_change = (lambda: print('%s (%s) has no _on_change callback set!' % (self._name, self._uuid)))
+        self._callback_container = (
+            lambda: print('%s (%s) has no _callback_container callback set!' % (self._name, self._uuid)))
+        self._after_update_callback = (
+            lambda: print('%s (%s) has no _after_update_callback callback set!' % (self._name, self._uuid)))
+        # The attributes of the entity class, its __init__ set them to None before the first update
+        for attribute in self._attributes:
+            setattr(self, attribute, None)
+        self.update_dev(dev, callback_container)
+
+    @property
+    def on_change(self):
+        return self._on_change
+
+    @on_change.setter
+    def on_change(self, func):
+        with self._callback_mutex:
+            self._on_change = func
+
+    def update_dev(self, dev, callback_container=None):
+        self._name = dev.get(KEY_NAME)
+        self._online = dev.get(KEY_ONLINE) == 'True'
+        self._model = dev.get(KEY_MODEL)
+        self._type = dev.get(KEY_TYPE)
+        if callback_container:
+            self._callback_container = callback_container
+            callback_container[INTERNAL_KEY_CALLBACK] = self._update
+
+    def _update(self, dev):
+        self.update_dev(dev)
+
+
+def legacy(entity_class):
+    """A LegacyEntity class with the attributes entity_class adds to CoCoEntity.
+
+    Every entity class had a class of its own, their instances share the keys of their __dict__.
+    """
+    attributes = tuple(attribute for cls in entity_class.__mro__ if cls is not CoCoEntity
+                       for attribute in getattr(cls, '__slots__', ()))
+    return type('Legacy' + entity_class.__name__, (LegacyEntity,), {'_attributes': attributes})
+
+
+def bytes_per_entity(entity_class, devices):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    entities = []
+    for dev in devices:
+        callback_container = {INTERNAL_KEY_CALLBACK: None, KEY_ENTITY: None}
+        entity = entity_class(dev, callback_container, None, 'profile', command_device_control)
+        callback_container[KEY_ENTITY] = entity
+        entities.append(entity)
+    entities[0].on_change = command_device_control
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    # Don't count the list holding the entities
+    allocated -= entities.__sizeof__()
+    return allocated / len(devices)
+
+
+print('%-14s %-16s %12s %12s' % ('device class', 'entity class', 'legacy bytes', 'slots bytes'))
+for device_class, device_set in DEVICE_SETS.items():
+    entity_class = device_set[INTERNAL_KEY_CLASS]
+    model = device_set[INTERNAL_KEY_MODELS][0]
+    devices = [device(i, model) for i in range(ENTITIES)]
+    legacy_based = bytes_per_entity(legacy(entity_class), devices)
+    slotted = bytes_per_entity(entity_class, devices)
+    print('%-14s %-16s %12.0f %12.0f' % (device_class.value, entity_class.__name__, legacy_based, slotted))
@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+from time import monotonic, process_time, sleep
+
+from nhc2_coco import CoCo, CoCoDeviceClass
+from nhc2_coco.coco_pool import CoCoPool
+from nhc2_coco.tests.coco_simulator import CoCoSimulator
+
+"""
+ Threads, memory and CPU of separate CoCo instances against a CoCoPool, by number of controllers.
+ All controllers are profiles on one CoCoSimulator that publishes EVENT_RATE devices.status events
+ per second to each of them. Needs openssl to make a self signed certificate for the simulator.
+
+ python benchmark_pool.py [controller count ...]
+"""
+CONTROLLER_COUNTS = [int(count) for count in sys.argv[1:]] or [1, 10, 40]
+DEVICES = 100
+EVENT_RATE = 20
+MEASURE_TIME = 3
+
+certificate_dir = tempfile.mkdtemp()
+cert_path = os.path.join(certificate_dir, 'cert.pem')
+key_path = os.path.join(certificate_dir, 'key.pem')
+subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=localhost',
+                '-days', '1', '-keyout', key_path, '-out', cert_path], check=True, capture_output=True)
+
+
+def ignore_changes(entities):
+    for entity in entities:
+        entity.on_change = lambda: None
+
+
+def run(name, controller_count, runtime):
+    profiles = {'profile-%d' % i: 'password' for i in range(controller_count)}
+    simulator = CoCoSimulator(device_count=DEVICES, profiles=profiles, certfile=cert_path, keyfile=key_path,
+                              event_rate=EVENT_RATE).start()
+    threads_before = threading.active_count()
+    tracemalloc.start()
+    create, close = runtime()
+    cocos = [create(profile, simulator.port) for profile in profiles]
+    for coco in cocos:
+        # Set when the devices are listed, before the first event reaches them
+        for device_class in CoCoDeviceClass:
+            coco.get_devices(device_class, ignore_changes)
+        coco.connect()
+    deadline = monotonic() + 30
+    while sum(len(coco.devices) for coco in cocos) < controller_count * DEVICES and monotonic() < deadline:
+        sleep(0.01)
+    # The simulator runs in this process too, its CPU is part of what's measured
+    cpu_started = process_time()
+    sleep(MEASURE_TIME)
+    cpu = (process_time() - cpu_started) / MEASURE_TIME
+    memory = tracemalloc.get_traced_memory()[0]
+    threads = threading.active_count() - threads_before
+    tracemalloc.stop()
+    closing_started = monotonic()
+    close(cocos)
+    closing = monotonic() - closing_started
+    simulator.stop()
+    print('%-6s %4d controllers %4d threads %8.0f kB %6.1f %% cpu  closed in %6.1f ms' % (
+        name, controller_count, threads, memory / 1024, cpu * 100, closing * 1e3))
+
+
+def separate_cocos():
+    def create(profile, port):
+        return CoCo('127.0.0.1', profile, 'password', port=port, ca_path=cert_path)
+
+    def close(cocos):
+        for coco in cocos:
+            coco.disconnect()
+
+    return create, close
+
+
+def pooled_cocos():
+    pool = CoCoPool()
+
+    def create(profile, port):
+        return pool.add('127.0.0.1', profile, 'password', port=port, ca_path=cert_path)
+
+    return create, lambda cocos: pool.close()
+
+
+for count in CONTROLLER_COUNTS:
+    run('CoCo', count, separate_cocos)
+    run('pool', count, pooled_cocos)
@@ -0,0 +1,72 @@
+import timeit
+
+from nhc2_coco.coco_climate import CoCoThermostat
+from nhc2_coco.coco_light import CoCoLight
+from nhc2_coco.helpers import extract_property_map, extract_property_value_from_device
+
+"""
+ Micro-benchmark of property extraction on a devices.status burst, as the controller
+ sends it after a scene: dimmers reporting Status/Brightness and thermostats
+ reporting all of their properties.
+"""
+DIMMERS = 300
+THERMOSTATS = 100
+THERMOSTAT_KEYS = ['AmbientTemperature', 'SetpointTemperature', 'Program', 'Demand',
+                   'OverruleActive', 'OverruleSetpoint', 'OverruleTime', 'EcoSave']
+
+
+def dimmer(i, on):
+    return {'Uuid': 'dimmer-%d' % i,
+            'Properties': [{'Status': 'On' if on else 'Off'}, {'Brightness': str(i % 100)}]}
+
+
+def thermostat(i, on):
+    return {'Uuid': 'thermostat-%d' % i,
+            'Properties': [{'AmbientTemperature': '20.5'}, {'SetpointTemperature': '21.0' if on else '19.0'},
+                           {'Program': 'Day' if on else 'Night'}, {'Demand': 'Heating' if on else 'None'},
+                           {'OverruleActive': 'False'}, {'OverruleSetpoint': '0.0'},
+                           {'OverruleTime': '0'}, {'EcoSave': 'False'}]}
+
+
+def burst(on):
+    return [dimmer(i, on) for i in range(DIMMERS)] + [thermostat(i, on) for i in range(THERMOSTATS)]
+
+
+def lookup_per_key(devices):
+    for device in devices:
+        for key in THERMOSTAT_KEYS:
+            extract_property_value_from_device(device, key)
+
+
+def lookup_with_map(devices):
+    for device in devices:
+        properties = extract_property_map(device)
+        for key in THERMOSTAT_KEYS:
+            properties.get(key)
+
+
+def new_entity(entity_class, device):
+    base = {'Uuid': device['Uuid'], 'Name': device['Uuid'], 'Model': 'dimmer', 'Type': 'action', 'Online': 'True'}
+    return entity_class(base, {}, None, 'profile', lambda *args: None)
+
+
+on_burst = burst(True)
+off_burst = burst(False)
+entities = [new_entity(CoCoLight, device) for device in on_burst[:DIMMERS]] + \
+           [new_entity(CoCoThermostat, device) for device in on_burst[DIMMERS:]]
+
+
+def update_devs():
+    for entity, device in zip(entities, on_burst):
+        entity.update_dev(device)
+    for entity, device in zip(entities, off_burst):
+        entity.update_dev(device)
+
+
+runs = 50
+print('%d devices per burst, best of 5 x %d runs' % (len(on_burst), runs))
+for name, func in (('lookup per key', lambda: lookup_per_key(on_burst)),
+                   ('lookup with property map', lambda: lookup_with_map(on_burst)),
+                   ('update_dev (on + off burst)', update_devs)):
+    best = min(timeit.repeat(func, number=runs, repeat=5)) / runs
+    print('%-30s %8.1f us/burst' % (name, best * 1e6))
@@ -0,0 +1,95 @@
+import sys
+from time import perf_counter
+
+from nhc2_coco import CoCo, CoCoCallbackExecutor, codec
+from nhc2_coco.coco_latency_stats import CoCoLatencyStats
+from nhc2_coco.coco_metrics import CoCoMetrics
+from nhc2_coco.coco_recorder import CoCoReplay, read_recording
+from nhc2_coco.const import MQTT_TOPIC_SUFFIX_RSP, MQTT_TOPIC_SUFFIX_EVT
+from nhc2_coco.coco_synthetic import INSTALLATION_SIZES, synthetic_devices, synthetic_traffic
+from nhc2_coco.helpers import extract_devices
+
+"""
+ Replays controller traffic through CoCo._on_message, no controller needed.
+ Reports messages/sec, the cost of update_dev per device class and the latency from
+ message arrival to on_change. Every run is done once more with CoCoMetrics enabled.
+
+ python benchmark_replay.py                  synthetic installations of 50, 500 and 5000 devices
+ python benchmark_replay.py session.rec.gz   a recording made with CoCoRecorder, the profile
+                                             is taken from its topics
+"""
+PROFILE = 'profile'
+EVENTS = 5000
+DEVICES_PER_EVENT = 4
+
+
+def run(name, messages, profile, metrics=None):
+    coco = CoCo('127.0.0.1', profile, 'password', callback_executor=CoCoCallbackExecutor(max_workers=0))
+    coco.metrics = metrics
+    latency = CoCoLatencyStats(size=len(messages) * DEVICES_PER_EVENT)
+
+    # Everything up to the first devices.list creates the entities, their callbacks are set before
+    # the rest is replayed
+    listed = next((index + 1 for index, (_, topic, _) in enumerate(messages)
+                   if topic.endswith(MQTT_TOPIC_SUFFIX_RSP)), 0)
+    list_replay = CoCoReplay(coco, messages[:listed])
+    list_replay.run()
+
+    started = [0.0]
+
+    def on_change():
+        latency.add(perf_counter() - started[0])
+
+    for entity in coco.devices:
+        entity.on_change = on_change
+
+    replay = CoCoReplay(coco, messages[listed:])
+    on_message = coco._on_message
+
+    def timed_on_message(client, userdata, message):
+        started[0] = perf_counter()
+        on_message(client, userdata, message)
+
+    coco._on_message = timed_on_message
+    replay.run()
+
+    if metrics is not None:
+        name += '+metrics'
+    print('%-20s %6d devices  list %7.1f ms  %6d msgs  %9.0f msgs/s  on_change p50 %6.1f us  p99 %6.1f us' % (
+        name, len(coco.devices), list_replay.elapsed * 1e3, replay.message_count, replay.messages_per_second,
+        (latency.p50 or 0) * 1e6, (latency.p99 or 0) * 1e6))
+    if metrics is None:
+        report_update_dev(coco, messages[listed:])
+    coco.disconnect()
+
+
+def report_update_dev(coco, messages):
+    # Time update_dev on its own, per device class, on the devices of the replayed events
+    spent = {}
+    for _, topic, payload in messages:
+        if not topic.endswith(MQTT_TOPIC_SUFFIX_EVT):
+            continue
+        for device in extract_devices(codec.loads(payload) if isinstance(payload, bytes) else payload):
+            entity = coco.get(device['Uuid'])
+            if entity is None:
+                continue
+            device_class = coco.devices.device_class_of(entity.uuid)
+            started = perf_counter()
+            entity.update_dev(device)
+            total, count = spent.get(device_class, (0.0, 0))
+            spent[device_class] = (total + perf_counter() - started, count + 1)
+    for device_class, (total, count) in sorted(spent.items(), key=lambda item: item[0].value):
+        print('    update_dev %-14s %7d calls %8.2f us/call' % (device_class.value, count, total / count * 1e6))
+
+
+if len(sys.argv) > 1:
+    recorded = list(read_recording(sys.argv[1]))
+    profile = recorded[0][1].split('/')[0] if recorded else PROFILE
+    run(sys.argv[1], recorded, profile)
+    run(sys.argv[1], recorded, profile, CoCoMetrics())
+else:
+    for size in INSTALLATION_SIZES:
+        traffic = list(synthetic_traffic(PROFILE, synthetic_devices(size), events=EVENTS,
+                                         devices_per_event=DEVICES_PER_EVENT))
+        run('synthetic', traffic, PROFILE)
+        run('synthetic', traffic, PROFILE, CoCoMetrics())
@@ -0,0 +1,380 @@
+"""A simulated NHC2 controller, to load test CoCo, CoCoProfiles and CoCoLoginValidation without the real thing.
+
+CoCoSimulator embeds a small MQTT 3.1.1 broker and plays the controller on the topics of const.py:
+it answers profiles.list, systeminfo.publish and devices.list, echoes devices.control as devices.changed
+and can publish random devices.status events.
+
+CoCo always connects over TLS, so give the simulator a certificate and key and connect with that certificate
+as ca_path, eg. a self signed one made with
+openssl req -x509 -newkey rsa:2048 -nodes -subj /CN=localhost -keyout key.pem -out cert.pem
+"""
+import asyncio
+import logging
+import random
+import ssl
+import struct
+import threading
+from time import monotonic
+
+from nhc2_coco import codec
+from nhc2_coco.coco_synthetic import synthetic_devices, synthetic_properties, devices_list_response, devices_status_event
+from nhc2_coco.const import KEY_METHOD, KEY_PARAMS, KEY_DEVICES, KEY_UUID, KEY_NAME, KEY_TYPE, KEY_MODEL, KEY_PROPERTIES, \
+    KEY_SYSTEM_INFO, KEY_SW_VERSIONS, KEY_LAST_CONFIG, KEY_PROFILES, MQTT_METHOD_PROFILES_LIST, \
+    MQTT_METHOD_SYSINFO_PUBLISH, MQTT_METHOD_SYSINFO_PUBLISHED, MQTT_METHOD_DEVICES_LIST, \
+    MQTT_METHOD_DEVICES_CONTROL, MQTT_METHOD_DEVICES_CHANGED, MQTT_TOPIC_PUBLIC_AUTH_CMD, \
+    MQTT_TOPIC_PUBLIC_AUTH_RSP, MQTT_TOPIC_PUBLIC_CMD, MQTT_TOPIC_PUBLIC_RSP, MQTT_TOPIC_SUFFIX_CMD, \
+    MQTT_TOPIC_SUFFIX_RSP, MQTT_TOPIC_SUFFIX_EVT, MQTT_TOPIC_SUFFIX_SYS_EVT
+
+_LOGGER = logging.getLogger(__name__)
+
+SIMULATOR_PROFILE = 'simulated-profile'
+SIMULATOR_PASSWORD = 'password'
+SIMULATOR_VERSION = 'simulator-1'
+
+# MQTT packet types
+_CONNECT = 1
+_CONNACK = 2
+_PUBLISH = 3
+_PUBACK = 4
+_PUBREC = 5
+_PUBREL = 6
+_PUBCOMP = 7
+_SUBSCRIBE = 8
+_SUBACK = 9
+_UNSUBSCRIBE = 10
+_UNSUBACK = 11
+_PINGREQ = 12
+_PINGRESP = 13
+_DISCONNECT = 14
+
+_CONNACK_ACCEPTED = 0
+_CONNACK_BAD_CREDENTIALS = 4
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        digit = length % 128
+        length //= 128
+        if length:
+            digit |= 0x80
+        encoded.append(digit)
+        if not length:
+            return bytes(encoded)
+
+
+def _encode_string(value):
+    value = value.encode('utf-8')
+    return struct.pack('!H', len(value)) + value
+
+
+def _packet(packet_type, flags, body):
+    return bytes([packet_type << 4 | flags]) + _encode_length(len(body)) + body
+
+
+def _topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels) or (level != '+' and level != topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class _Session:
+    __slots__ = ('writer', 'username', 'subscriptions')
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.username = None
+        self.subscriptions = set()
+
+
+class CoCoSimulator:
+    """CoCoSimulator is a fake NHC2 controller with an embedded MQTT broker, it runs on its own thread.
+
+    simulator = CoCoSimulator(device_count=500, certfile='cert.pem', keyfile='key.pem').start()
+    coco = CoCo('127.0.0.1', SIMULATOR_PROFILE, SIMULATOR_PASSWORD, port=simulator.port, ca_path='cert.pem')
+
+    profiles maps profile uuids to their password. latency delays every answer by that many seconds and
+    event_rate is the number of devices.status events per second, each with devices_per_event random devices.
+    """
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def devices(self):
+        return self._devices
+
+    @property
+    def client_count(self):
+        return len(self._sessions)
+
+    @property
+    def received_count(self):
+        """The number of messages published by the clients."""
+        return self._received_count
+
+    @property
+    def controlled_count(self):
+        """The number of device states changed by devices.control."""
+        return self._controlled_count
+
+    def __init__(self, devices=None, device_count=50, profiles=None, host='127.0.0.1', port=0,
+                 certfile=None, keyfile=None, latency=0.0, event_rate=0.0, devices_per_event=1, seed=0):
+        self._devices = devices if devices is not None else synthetic_devices(device_count, seed)
+        self._devices_by_uuid = {device[KEY_UUID]: device for device in self._devices}
+        self._profiles = profiles if profiles is not None else {SIMULATOR_PROFILE: SIMULATOR_PASSWORD}
+        self._host = host
+        self._port = port
+        self._ssl_context = None
+        if certfile:
+            self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self._ssl_context.load_cert_chain(certfile, keyfile)
+        self._latency = latency
+        self._event_rate = event_rate
+        self._devices_per_event = devices_per_event
+        self._random = random.Random(seed)
+        self._sessions = {}
+        self._received_count = 0
+        self._controlled_count = 0
+        self._last_config = str(monotonic())
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Start the broker, returns once it accepts connections."""
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle_client, self._host, self._port, ssl=self._ssl_context))
+            self._port = self._server.sockets[0].getsockname()[1]
+            if self._event_rate:
+                self._loop.create_task(self._publish_events())
+            started.set()
+            self._loop.run_forever()
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(self._server.wait_closed(), *tasks, return_exceptions=True))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._stop)
+        self._thread.join()
+        self._loop = None
+
+    def disconnect_clients(self):
+        """Drop every client connection, as a controller reboot would."""
+        self._loop.call_soon_threadsafe(self._disconnect_clients)
+
+    def publish(self, topic, message):
+        """Publish message (a dict) to the subscribers of topic, from any thread."""
+        self._loop.call_soon_threadsafe(self._publish, topic, message)
+
+    def reconfigure(self, devices):
+        """Replace the devices and announce it with systeminfo.published, like a new configuration would."""
+        self._loop.call_soon_threadsafe(self._reconfigure, devices)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _stop(self):
+        self._disconnect_clients()
+        self._loop.stop()
+
+    def _disconnect_clients(self):
+        for session in list(self._sessions.values()):
+            session.writer.close()
+        self._sessions.clear()
+
+    def _reconfigure(self, devices):
+        self._devices = devices
+        self._devices_by_uuid = {device[KEY_UUID]: device for device in devices}
+        self._last_config = str(monotonic())
+        for profile in self._profiles:
+            self._publish(profile + MQTT_TOPIC_SUFFIX_SYS_EVT, {KEY_METHOD: MQTT_METHOD_SYSINFO_PUBLISHED})
+
+    async def _handle_client(self, reader, writer):
+        session = _Session(writer)
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                multiplier, length = 1, 0
+                while True:
+                    digit = (await reader.readexactly(1))[0]
+                    length += (digit & 0x7f) * multiplier
+                    multiplier *= 128
+                    if not digit & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                packet_type = header >> 4
+                if packet_type == _CONNECT:
+                    if not self._connect(session, body):
+                        break
+                elif packet_type == _PUBLISH:
+                    self._on_publish(session, header, body)
+                elif packet_type == _PUBREL:
+                    writer.write(_packet(_PUBCOMP, 0, body[:2]))
+                elif packet_type == _SUBSCRIBE:
+                    self._subscribe(session, body)
+                elif packet_type == _UNSUBSCRIBE:
+                    self._unsubscribe(session, body)
+                elif packet_type == _PINGREQ:
+                    writer.write(_packet(_PINGRESP, 0, b''))
+                elif packet_type == _DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            self._sessions.pop(id(session), None)
+            writer.close()
+
+    def _connect(self, session, body):
+        position = 2 + struct.unpack('!H', body[:2])[0]
+        flags = body[position + 1]
+        position += 4
+        client_id_length = struct.unpack('!H', body[position:position + 2])[0]
+        position += 2 + client_id_length
+        if flags & 0x04:
+            for _ in range(2):
+                position += 2 + struct.unpack('!H', body[position:position + 2])[0]
+        username = password = None
+        if flags & 0x80:
+            length = struct.unpack('!H', body[position:position + 2])[0]
+            username = body[position + 2:position + 2 + length].decode('utf-8')
+            position += 2 + length
+        if flags & 0x40:
+            length = struct.unpack('!H', body[position:position + 2])[0]
+            password = body[position + 2:position + 2 + length].decode('utf-8')
+        # Without a username only the public topics are of any use, like on the real controller
+        if username is not None and self._profiles.get(username) != password:
+            _LOGGER.debug('Refused %s, bad username or password', username)
+            session.writer.write(_packet(_CONNACK, 0, bytes([0, _CONNACK_BAD_CREDENTIALS])))
+            return False
+        session.username = username
+        self._sessions[id(session)] = session
+        session.writer.write(_packet(_CONNACK, 0, bytes([0, _CONNACK_ACCEPTED])))
+        return True
+
+    def _subscribe(self, session, body):
+        packet_id = body[:2]
+        position = 2
+        granted = bytearray()
+        while position < len(body):
+            length = struct.unpack('!H', body[position:position + 2])[0]
+            session.subscriptions.add(body[position + 2:position + 2 + length].decode('utf-8'))
+            granted.append(min(body[position + 2 + length], 1))
+            position += 3 + length
+        session.writer.write(_packet(_SUBACK, 0, packet_id + bytes(granted)))
+
+    def _unsubscribe(self, session, body):
+        position = 2
+        while position < len(body):
+            length = struct.unpack('!H', body[position:position + 2])[0]
+            session.subscriptions.discard(body[position + 2:position + 2 + length].decode('utf-8'))
+            position += 2 + length
+        session.writer.write(_packet(_UNSUBACK, 0, body[:2]))
+
+    def _on_publish(self, session, header, body):
+        qos = (header >> 1) & 3
+        length = struct.unpack('!H', body[:2])[0]
+        topic = body[2:2 + length].decode('utf-8')
+        position = 2 + length
+        if qos:
+            packet_id = body[position:position + 2]
+            position += 2
+            session.writer.write(_packet(_PUBACK if qos == 1 else _PUBREC, 0, packet_id))
+        self._received_count += 1
+        try:
+            message = codec.loads(body[position:])
+        except ValueError:
+            return
+        answer = self._answer(session, topic, message)
+        if answer is None:
+            return
+        if self._latency:
+            self._loop.call_later(self._latency, self._publish, *answer)
+        else:
+            self._publish(*answer)
+
+    def _answer(self, session, topic, message):
+        """Return the (topic, message) the controller answers message on topic with, or None."""
+        method = message.get(KEY_METHOD)
+        if topic == MQTT_TOPIC_PUBLIC_AUTH_CMD and method == MQTT_METHOD_PROFILES_LIST:
+            profiles = [{KEY_UUID: profile, KEY_NAME: profile, KEY_TYPE: 'hobby'} for profile in self._profiles]
+            return MQTT_TOPIC_PUBLIC_AUTH_RSP, {KEY_METHOD: method, KEY_PARAMS: [{KEY_PROFILES: profiles}]}
+        profile = session.username
+        if profile is None or not topic.startswith(profile + '/'):
+            return None
+        suffix = topic[len(profile):]
+        if suffix == MQTT_TOPIC_PUBLIC_CMD and method == MQTT_METHOD_SYSINFO_PUBLISH:
+            system_info = {KEY_SW_VERSIONS: [{'CocoImage': SIMULATOR_VERSION}], KEY_LAST_CONFIG: self._last_config}
+            return profile + MQTT_TOPIC_PUBLIC_RSP, {KEY_METHOD: method, KEY_PARAMS: [{KEY_SYSTEM_INFO: [system_info]}]}
+        if suffix == MQTT_TOPIC_SUFFIX_CMD and method == MQTT_METHOD_DEVICES_LIST:
+            return profile + MQTT_TOPIC_SUFFIX_RSP, devices_list_response(self._devices)
+        if suffix == MQTT_TOPIC_SUFFIX_CMD and method == MQTT_METHOD_DEVICES_CONTROL:
+            controlled = message[KEY_PARAMS][0][KEY_DEVICES]
+            for device in controlled:
+                self._set_properties(device[KEY_UUID], device.get(KEY_PROPERTIES) or [])
+            self._controlled_count += len(controlled)
+            return profile + MQTT_TOPIC_SUFFIX_EVT, {KEY_METHOD: MQTT_METHOD_DEVICES_CHANGED,
+                                                     KEY_PARAMS: [{KEY_DEVICES: controlled}]}
+        return None
+
+    def _set_properties(self, uuid, properties):
+        device = self._devices_by_uuid.get(uuid)
+        if device is None:
+            return
+        current = device[KEY_PROPERTIES]
+        for property_object in properties:
+            for key, value in property_object.items():
+                for current_object in current:
+                    if key in current_object:
+                        current_object[key] = value
+                        break
+                else:
+                    current.append({key: value})
+
+    def _publish(self, topic, message):
+        payload = codec.dumps(message)
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        packet = _packet(_PUBLISH, 0, _encode_string(topic) + payload)
+        for session in list(self._sessions.values()):
+            if any(_topic_matches(topic_filter, topic) for topic_filter in session.subscriptions):
+                session.writer.write(packet)
+
+    async def _publish_events(self):
+        interval = 1 / self._event_rate
+        next_event = self._loop.time()
+        while True:
+            next_event += interval
+            await asyncio.sleep(max(0.0, next_event - self._loop.time()))
+            changed = []
+            for device in self._random.sample(self._devices, min(self._devices_per_event, len(self._devices))):
+                properties = synthetic_properties(device[KEY_MODEL], self._random)
+                self._set_properties(device[KEY_UUID], properties)
+                changed.append({KEY_UUID: device[KEY_UUID], KEY_PROPERTIES: properties})
+            for profile in self._profiles:
+                self._publish(profile + MQTT_TOPIC_SUFFIX_EVT, devices_status_event(changed))
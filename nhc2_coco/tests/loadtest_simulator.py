@@ -0,0 +1,107 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from time import monotonic, sleep
+
+from nhc2_coco import CoCo, CoCoDeviceClass
+from nhc2_coco.coco_latency_stats import CoCoLatencyStats
+from nhc2_coco.coco_login_validation import CoCoLoginValidation
+from nhc2_coco.coco_profiles import CoCoProfiles
+from nhc2_coco.tests.coco_simulator import CoCoSimulator, SIMULATOR_PROFILE, SIMULATOR_PASSWORD
+
+"""
+ End to end load test of CoCo, CoCoProfiles and CoCoLoginValidation against a CoCoSimulator.
+ Needs openssl to make a self signed certificate for the simulator.
+
+ python loadtest_simulator.py [device count] [answer latency in seconds] [events per second]
+"""
+DEVICE_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+LATENCY = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+EVENT_RATE = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+COMMAND_ROUNDS = 5
+
+certificate_dir = tempfile.mkdtemp()
+cert_path = os.path.join(certificate_dir, 'cert.pem')
+key_path = os.path.join(certificate_dir, 'key.pem')
+subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=localhost',
+                '-days', '1', '-keyout', key_path, '-out', cert_path], check=True, capture_output=True)
+
+simulator = CoCoSimulator(device_count=DEVICE_COUNT, certfile=cert_path, keyfile=key_path,
+                          latency=LATENCY, event_rate=EVENT_RATE).start()
+print('simulator with %d devices on port %d, latency %.3f s, %.0f events/s' % (
+    DEVICE_COUNT, simulator.port, LATENCY, EVENT_RATE))
+
+# Profiles and login validation
+started = monotonic()
+profiles = []
+CoCoProfiles(profiles.extend, '127.0.0.1', lambda: None, port=simulator.port, ca_path=cert_path, timeout=10)
+print('profiles.list                  %8.1f ms  %s' % ((monotonic() - started) * 1e3, [p['Uuid'] for p in profiles]))
+
+for password in (SIMULATOR_PASSWORD, 'wrong'):
+    started = monotonic()
+    result = asyncio.run(CoCoLoginValidation('127.0.0.1', SIMULATOR_PROFILE, password, port=simulator.port,
+                                             ca_path=cert_path).check_connection())
+    print('login validation (%-8s)    %8.1f ms  result %d' % (password, (monotonic() - started) * 1e3, result))
+
+# Connect and list
+listed = threading.Event()
+coco = CoCo('127.0.0.1', SIMULATOR_PROFILE, SIMULATOR_PASSWORD, port=simulator.port, ca_path=cert_path)
+coco.get_devices(CoCoDeviceClass.LIGHTS, lambda lights: listed.set())
+started = monotonic()
+coco.connect()
+listed.wait(30)
+print('connect to devices listed      %8.1f ms  %d entities' % ((monotonic() - started) * 1e3, len(coco.devices)))
+
+# Command round trips: every light toggled at once, until all of them reported back
+lights = coco.by_device_class(CoCoDeviceClass.LIGHTS)
+round_trip = CoCoLatencyStats(size=len(lights) * COMMAND_ROUNDS)
+pending = {}
+pending_lock = threading.Lock()
+all_confirmed = threading.Event()
+
+
+def confirm(light):
+    def on_change():
+        with pending_lock:
+            sent_at = pending.pop(light.uuid, None)
+            if sent_at is not None:
+                round_trip.add(monotonic() - sent_at)
+            if not pending:
+                all_confirmed.set()
+    return on_change
+
+
+for light in lights:
+    light.on_change = confirm(light)
+
+started = monotonic()
+for command_round in range(COMMAND_ROUNDS):
+    all_confirmed.clear()
+    with pending_lock:
+        for light in lights:
+            pending[light.uuid] = monotonic()
+    for light in lights:
+        if light.is_on:
+            light.turn_off()
+        else:
+            light.turn_on()
+    all_confirmed.wait(30)
+elapsed = monotonic() - started
+print('%-6d commands                 %8.1f ms  %8.0f commands/s  rtt p50 %.1f ms  p99 %.1f ms' % (
+    len(lights) * COMMAND_ROUNDS, elapsed * 1e3, len(lights) * COMMAND_ROUNDS / elapsed,
+    (round_trip.p50 or 0) * 1e3, (round_trip.p99 or 0) * 1e3))
+
+# Reconnect: the simulator drops the connection, until paho is connected again
+started = monotonic()
+simulator.disconnect_clients()
+while simulator.client_count:
+    sleep(0.001)
+while not simulator.client_count:
+    sleep(0.001)
+print('reconnect                      %8.1f ms' % ((monotonic() - started) * 1e3))
+
+coco.disconnect()
+simulator.stop()
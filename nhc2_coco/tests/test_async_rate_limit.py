@@ -0,0 +1,57 @@
+import asyncio
+import os
+import subprocess
+import tempfile
+import threading
+
+from nhc2_coco import AsyncCoCo, CoCoDeviceClass
+from nhc2_coco.const import DEVICE_CONTROL_BUFFER_SIZE
+from nhc2_coco.tests.coco_simulator import CoCoSimulator, SIMULATOR_PROFILE, SIMULATOR_PASSWORD
+
+"""
+ Regression test: a full device control buffer whose devices are all rate limited must not
+ block the event loop of an AsyncCoCo. Needs openssl to make a self signed certificate.
+
+ python test_async_rate_limit.py
+"""
+TIMEOUT = 20
+
+
+def test_rate_limited_full_buffer_does_not_block_the_event_loop():
+    certificate_dir = tempfile.mkdtemp()
+    cert_path = os.path.join(certificate_dir, 'cert.pem')
+    key_path = os.path.join(certificate_dir, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=localhost',
+                    '-days', '1', '-keyout', key_path, '-out', cert_path], check=True, capture_output=True)
+    result = {}
+
+    async def scenario(port):
+        coco = AsyncCoCo('127.0.0.1', SIMULATOR_PROFILE, SIMULATOR_PASSWORD, port=port, ca_path=cert_path,
+                         device_control_rate_limit=1)
+        await coco.connect()
+        while not coco.by_device_class(CoCoDeviceClass.LIGHTS):
+            await asyncio.sleep(0.01)
+        lights = coco.by_device_class(CoCoDeviceClass.LIGHTS)[:DEVICE_CONTROL_BUFFER_SIZE + 1]
+        confirmations = [light.turn_on() for light in lights[:DEVICE_CONTROL_BUFFER_SIZE]]
+        # Published, the next commands for these lights have to wait a second
+        await asyncio.sleep(0.2)
+        confirmations += [light.turn_off() for light in lights[:DEVICE_CONTROL_BUFFER_SIZE]]
+        # The buffer is full of rate limited commands, this used to wait for room forever
+        confirmations.append(lights[-1].turn_on())
+        result['confirmed'] = await asyncio.wait_for(asyncio.gather(*confirmations), TIMEOUT / 2)
+        result['is_on'] = [light.is_on for light in lights]
+        await coco.disconnect()
+
+    with CoCoSimulator(device_count=200, certfile=cert_path, keyfile=key_path) as simulator:
+        # A blocked event loop can't time itself out, so it runs on a thread that is given up on
+        thread = threading.Thread(target=lambda: asyncio.run(scenario(simulator.port)), daemon=True)
+        thread.start()
+        thread.join(TIMEOUT)
+        assert not thread.is_alive(), 'The event loop is blocked'
+    assert len(result['confirmed']) == 2 * DEVICE_CONTROL_BUFFER_SIZE + 1
+    assert result['is_on'] == [False] * DEVICE_CONTROL_BUFFER_SIZE + [True]
+
+
+if __name__ == '__main__':
+    test_rate_limited_full_buffer_does_not_block_the_event_loop()
+    print('ok')
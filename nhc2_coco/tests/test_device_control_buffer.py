@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+from nhc2_coco import CoCoBufferPolicy
+from nhc2_coco.coco_device_control_buffer import CoCoDeviceControlBuffer, CoCoDeviceControlBufferFull
+
+"""
+ Tests of the device control buffer when it is full.
+
+ python -m pytest test_device_control_buffer.py
+"""
+
+
+def test_drop_oldest_makes_room_for_the_commands_of_a_dropped_device():
+    buffer = CoCoDeviceControlBuffer(size=2, command_size=3, policy=CoCoBufferPolicy.DROP_OLDEST)
+    buffer.add_commands({'a': {'Status': 'On', 'Brightness': '10'}})
+    buffer.add_commands({'b': {'Status': 'On'}})
+    # 'a' is dropped to make room, so its commands have to fit as a new device
+    buffer.add_commands({'a': {'Status': 'Off', 'Brightness': '20'}, 'c': {'Status': 'On'}})
+    assert len(buffer) <= 3
+    commands, enqueue_times = buffer.take_nowait()
+    assert commands == {'a': {'Status': 'Off', 'Brightness': '20'}, 'c': {'Status': 'On'}}
+    assert len(enqueue_times) == 3
+    assert buffer.dropped_count == 3
+
+
+def test_block_raises_when_the_buffer_is_closed_while_waiting():
+    buffer = CoCoDeviceControlBuffer(size=1, policy=CoCoBufferPolicy.BLOCK)
+    buffer.add('a', 'Status', 'On')
+    errors = []
+
+    def add():
+        try:
+            buffer.add_commands({'b': {'Status': 'On'}})
+        except CoCoDeviceControlBufferFull as e:
+            errors.append(e)
+
+    producer = threading.Thread(target=add)
+    producer.start()
+    while buffer.throttled_count == 0:
+        pass
+    buffer.close()
+    producer.join(5)
+    assert not producer.is_alive()
+    assert len(errors) == 1
+    assert len(buffer) == 1
+    assert buffer.rejected_count == 1
+
+
+def test_block_single_command_raises_when_closed():
+    buffer = CoCoDeviceControlBuffer(size=1, policy=CoCoBufferPolicy.BLOCK, timeout=5)
+    buffer.add('a', 'Status', 'On')
+    threading.Timer(0.1, buffer.close).start()
+    with pytest.raises(CoCoDeviceControlBufferFull):
+        buffer.add('b', 'Status', 'On')
+
+
+if __name__ == '__main__':
+    test_drop_oldest_makes_room_for_the_commands_of_a_dropped_device()
+    test_block_raises_when_the_buffer_is_closed_while_waiting()
+    test_block_single_command_raises_when_closed()
+    print('ok')